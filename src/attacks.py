@@ -0,0 +1,189 @@
+from array import array
+from bitops import BIT, EMPTY, MASK_64, popcount
+from tables import cached_tables
+
+# Precomputed attack tables, indexed by square. Squares follow the bitboard
+# layout: bit 0 is h1, bit 7 is a1 and bit 63 is a8, so the low three bits
+# count files from the h-file and the high three bits count ranks.
+
+KNIGHT_OFFSETS = [(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)]
+KING_OFFSETS = [(1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1)]
+PAWN_OFFSETS = {
+	'white': [(1, 1), (1, -1)],
+	'black': [(-1, 1), (-1, -1)]
+}
+
+def _leaper_attacks(sq, offsets):
+	rank, file = sq >> 3, sq & 7
+	attacks = EMPTY
+	for d_rank, d_file in offsets:
+		to_rank, to_file = rank + d_rank, file + d_file
+		if 0 <= to_rank < 8 and 0 <= to_file < 8:
+			attacks |= BIT[to_rank * 8 + to_file]
+
+	return attacks
+
+KNIGHT_ATTACKS = [_leaper_attacks(sq, KNIGHT_OFFSETS) for sq in range(64)]
+KING_ATTACKS = [_leaper_attacks(sq, KING_OFFSETS) for sq in range(64)]
+PAWN_ATTACKS = {
+	color: [_leaper_attacks(sq, offsets) for sq in range(64)]
+	for color, offsets in PAWN_OFFSETS.items()
+}
+
+# Sliding attacks use fancy magic bitboards: the blockers on a square's
+# relevant rays are multiplied by a per-square magic so that the top bits of
+# the product form a dense, collision-free index into a shared attack table.
+# The magics were found offline by trial with sparse random numbers.
+
+ROOK_DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+BISHOP_DIRECTIONS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+ROOK_MAGICS = [
+	0x2080001440022581, 0x1080200040001080, 0x4080100008200080, 0x0280080080100254,
+	0x4d8004000a180080, 0x0100080400020100, 0x1080010040800200, 0x0200004402002081,
+	0x0068800024884004, 0x1000804000802002, 0x000200208a001040, 0x3008801000800800,
+	0x2006001060440a00, 0x1000800200800400, 0x0004000441024810, 0xa001000082004100,
+	0x0040808000204014, 0x0000424002201000, 0x0010110041002000, 0x0000090021041000,
+	0x0204008004800800, 0x0000808004000200, 0x6006040021485042, 0x0000020002409924,
+	0x2000401980028020, 0x4000400100308100, 0x0000820200201041, 0xb100100080800800,
+	0x3004080080040080, 0x0802000200041009, 0x01a0580400021110, 0x00020042000408a1,
+	0x4218884000800023, 0x0480201000400045, 0x0010200080801000, 0x1200200901001000,
+	0x0000100801000500, 0x0080020080800400, 0x004a000100404080, 0x0480005402001081,
+	0x258000402000c000, 0xa010004820084002, 0x0480200010008080, 0x244100100021000c,
+	0x2040080005010010, 0x0012000810020004, 0x0011000200b9000c, 0x1121000080410002,
+	0x00082080410a0600, 0x4002008100402600, 0x0a0300e008544100, 0x7b00080010008080,
+	0x0300080100100500, 0x0002020080040080, 0x0042521810214400, 0x8a00004089140200,
+	0x00001280010a2041, 0x0400401102042086, 0x41902000100c4101, 0x0043020420900009,
+	0x00e2000410082002, 0x4402000108041002, 0x2100101a00814804, 0x0400010400218246
+]
+
+BISHOP_MAGICS = [
+	0x0102040418220020, 0x0108024802002028, 0x8010044040400001, 0x0022209200044800,
+	0x4004504005040114, 0x0022010420a80800, 0x0008441008090002, 0x0000420801480200,
+	0x1100220244011c00, 0x00883004081ab020, 0x4400100152002000, 0x4019080841004000,
+	0x2861021210000000, 0x400ea10108400020, 0x4800208208a24000, 0x0020a500a0842085,
+	0x3410000802504400, 0x0010e0200c010060, 0x0014182042408200, 0x4094006840112109,
+	0x2014200202010000, 0x000100020080c400, 0x800400420d2c0200, 0x0002200182251000,
+	0x0010f10304c41000, 0x001024a008281084, 0x0088110002040100, 0x0820080001004008,
+	0x0104040020410050, 0x0110002027040500, 0x418c008009182100, 0x2c00a9040c80480b,
+	0x008110c8005020a4, 0x4004210802041000, 0x0004020108208100, 0x0000080800120a00,
+	0x430c008400820102, 0x1400808100020108, 0x005006020010a8a0, 0x000801868004a220,
+	0x00420105c00c2000, 0x1010921032019040, 0x0300222028103000, 0x0008004208001080,
+	0x5410202248811400, 0x0008010800800808, 0x3c02c20404000900, 0x0408022282040032,
+	0x0000941002100000, 0x0112209a10100804, 0x080c020111210000, 0x442002a442022008,
+	0x00084a181b040000, 0x00115021021c2080, 0x4010051000a20000, 0x0404688085060000,
+	0x0000220110011000, 0x140000220734200c, 0x0440010424020800, 0x2204828883460800,
+	0x0020000004050410, 0x4060004a20082080, 0x00489034b002c201, 0x0444049010410300
+]
+
+def _ray_attacks(sq, occupancy, directions):
+	rank, file = sq >> 3, sq & 7
+	attacks = 0
+	for d_rank, d_file in directions:
+		to_rank, to_file = rank + d_rank, file + d_file
+		while 0 <= to_rank < 8 and 0 <= to_file < 8:
+			bit = 1<<(to_rank * 8 + to_file)
+			attacks |= bit
+			if occupancy & bit:
+				break
+			to_rank, to_file = to_rank + d_rank, to_file + d_file
+
+	return attacks
+
+# Squares whose occupancy can change the attack set: each ray minus its edge
+def _relevant_mask(sq, directions):
+	rank, file = sq >> 3, sq & 7
+	mask = 0
+	for d_rank, d_file in directions:
+		to_rank, to_file = rank + d_rank, file + d_file
+		while 0 <= to_rank + d_rank < 8 and 0 <= to_file + d_file < 8:
+			mask |= 1<<(to_rank * 8 + to_file)
+			to_rank, to_file = to_rank + d_rank, to_file + d_file
+
+	return mask
+
+def _build_sliding(directions, magics):
+	masks, shifts, offsets = [], [], []
+	table = array('Q')
+	for sq in range(64):
+		mask = _relevant_mask(sq, directions)
+		shift = 64 - popcount(mask)
+		offset = len(table)
+		table.extend([0] * (1<<(64 - shift)))
+
+		# Walk every subset of the mask (carry-rippler)
+		occupancy = 0
+		while True:
+			index = offset + (((occupancy * magics[sq]) & MASK_64) >> shift)
+			table[index] = _ray_attacks(sq, occupancy, directions)
+			occupancy = (occupancy - mask) & mask
+			if not occupancy:
+				break
+
+		masks.append(mask)
+		shifts.append(shift)
+		offsets.append(offset)
+
+	return masks, shifts, offsets, table
+
+def rook_attacks(sq, occupancy):
+	index = (((occupancy & ROOK_MASKS[sq]) * ROOK_MAGICS[sq]) & MASK_64) >> ROOK_SHIFTS[sq]
+	return ROOK_TABLE[ROOK_OFFSETS[sq] + index]
+
+def bishop_attacks(sq, occupancy):
+	index = (((occupancy & BISHOP_MASKS[sq]) * BISHOP_MAGICS[sq]) & MASK_64) >> BISHOP_SHIFTS[sq]
+	return BISHOP_TABLE[BISHOP_OFFSETS[sq] + index]
+
+def queen_attacks(sq, occupancy):
+	return rook_attacks(sq, occupancy) | bishop_attacks(sq, occupancy)
+
+# BETWEEN[a][b] holds the squares strictly between two squares that share a
+# rank, file or diagonal, LINE[a][b] the whole line through both. Both are 0
+# for squares that aren't aligned. Check evasions and pins are built on them.
+def _build_lines():
+	between = [[0] * 64 for sq in range(64)]
+	line = [[0] * 64 for sq in range(64)]
+	for sq in range(64):
+		rank, file = sq >> 3, sq & 7
+		for d_rank, d_file in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+			full = _ray_attacks(sq, 0, [(d_rank, d_file), (-d_rank, -d_file)]) | 1<<sq
+			path = 0
+			to_rank, to_file = rank + d_rank, file + d_file
+			while 0 <= to_rank < 8 and 0 <= to_file < 8:
+				to_sq = to_rank * 8 + to_file
+				between[sq][to_sq] = path
+				line[sq][to_sq] = full
+				path |= 1<<to_sq
+				to_rank, to_file = to_rank + d_rank, to_file + d_file
+
+	return between, line
+
+
+# Building the magic tables takes most of a second, so they and the line
+# tables are loaded from the table cache and only built when it is stale
+def _build_tables():
+	tables = {}
+	for name, directions, magics in (('rook', ROOK_DIRECTIONS, ROOK_MAGICS), ('bishop', BISHOP_DIRECTIONS, BISHOP_MAGICS)):
+		masks, shifts, offsets, table = _build_sliding(directions, magics)
+		tables[name + '_masks'] = masks
+		tables[name + '_shifts'] = shifts
+		tables[name + '_offsets'] = offsets
+		tables[name + '_table'] = table
+
+	between, line = _build_lines()
+	tables['between'] = [bb for row in between for bb in row]
+	tables['line'] = [bb for row in line for bb in row]
+	return tables
+
+_tables = cached_tables('attacks', __file__, _build_tables)
+
+ROOK_MASKS = _tables['rook_masks'].tolist()
+ROOK_SHIFTS = _tables['rook_shifts'].tolist()
+ROOK_OFFSETS = _tables['rook_offsets'].tolist()
+ROOK_TABLE = _tables['rook_table']
+BISHOP_MASKS = _tables['bishop_masks'].tolist()
+BISHOP_SHIFTS = _tables['bishop_shifts'].tolist()
+BISHOP_OFFSETS = _tables['bishop_offsets'].tolist()
+BISHOP_TABLE = _tables['bishop_table']
+BETWEEN = [_tables['between'][sq * 64:(sq + 1) * 64].tolist() for sq in range(64)]
+LINE = [_tables['line'][sq * 64:(sq + 1) * 64].tolist() for sq in range(64)]
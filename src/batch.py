@@ -0,0 +1,212 @@
+from bitboard import COLORS, PIECE_BASE, WHITE
+from evaluate import MG_PST, EG_PST, PHASE_WEIGHTS, TOTAL_PHASE
+from move import PIECE_CODES
+from pawns import DOUBLED, ISOLATED, BACKWARD, PASSED_MG, PASSED_EG, PASSED_BLOCKED, SHIELD_NEAR, SHIELD_FAR
+
+# numpy is only needed here, not by the engine, so it isn't a requirement
+try:
+	import numpy as np
+except ImportError:
+	raise ImportError('batch evaluation needs numpy, install it with: pip install numpy') from None
+
+# Offline scoring of many positions at once, for tuning and data
+# generation. Positions come in as an N x 12 uint64 array of piece
+# bitboards, in the same bit layout as Bitboard (bit 0 = h1, bit 63 = a8),
+# plus a boolean side-to-move array. Scores use the tables in evaluate.py
+# and the pawn terms in pawns.py, so they always agree with
+# Bitboard.evaluate.
+
+BATCH_PIECES = ['pawn', 'knight', 'bishop', 'rook', 'queen', 'king']
+BATCH_COLUMNS = [(color, piece) for color in ('white', 'black') for piece in BATCH_PIECES]
+
+MG_ARRAY = np.array([MG_PST[color][piece] for color, piece in BATCH_COLUMNS], dtype=np.int64)
+EG_ARRAY = np.array([EG_PST[color][piece] for color, piece in BATCH_COLUMNS], dtype=np.int64)
+PHASE_ARRAY = np.array([PHASE_WEIGHTS[piece] for color, piece in BATCH_COLUMNS], dtype=np.int64)
+
+FULL = np.uint64(0xFFFFFFFFFFFFFFFF)
+FILE_A = np.uint64(0x8080808080808080)
+FILE_B = np.uint64(0x4040404040404040)
+FILE_G = np.uint64(0x0202020202020202)
+FILE_H = np.uint64(0x0101010101010101)
+RANK_1 = np.uint64(0x00000000000000FF)
+RANK_3 = np.uint64(0x0000000000FF0000)
+RANK_6 = np.uint64(0x0000FF0000000000)
+RANK_8 = np.uint64(0xFF00000000000000)
+RANKS = [np.uint64(0xFF<<(8 * rank)) for rank in range(8)]
+
+# (shift, squares that may move) for each direction. Positive shifts go up
+# the bit indices, towards rank 8 or the a-file.
+NORTH = (8, FULL)
+SOUTH = (-8, FULL)
+EAST = (-1, ~FILE_H)
+WEST = (1, ~FILE_A)
+NORTH_EAST = (7, ~FILE_H)
+NORTH_WEST = (9, ~FILE_A)
+SOUTH_EAST = (-9, ~FILE_H)
+SOUTH_WEST = (-7, ~FILE_A)
+
+ROOK_DIRECTIONS = [NORTH, SOUTH, EAST, WEST]
+BISHOP_DIRECTIONS = [NORTH_EAST, NORTH_WEST, SOUTH_EAST, SOUTH_WEST]
+KING_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+KNIGHT_DIRECTIONS = [
+	(17, ~FILE_A), (15, ~FILE_H), (10, ~(FILE_A | FILE_B)), (6, ~(FILE_G | FILE_H)),
+	(-6, ~(FILE_A | FILE_B)), (-10, ~(FILE_G | FILE_H)), (-15, ~FILE_A), (-17, ~FILE_H)
+]
+
+PROMOTIONS = 4
+
+def _shift(bb, direction):
+	shift, movable = direction
+	bb = bb & movable
+	return bb << np.uint64(shift) if shift > 0 else bb >> np.uint64(-shift)
+
+# numpy 2 has a native popcount, older versions get the SWAR one
+if hasattr(np, 'bitwise_count'):
+	def popcount(bb):
+		return np.bitwise_count(bb).astype(np.int64)
+else:
+	def popcount(bb):
+		bb = bb - ((bb >> np.uint64(1)) & np.uint64(0x5555555555555555))
+		bb = (bb & np.uint64(0x3333333333333333)) + ((bb >> np.uint64(2)) & np.uint64(0x3333333333333333))
+		bb = (bb + (bb >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+		return ((bb * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+def _north_fill(bb):
+	for shift in (8, 16, 32):
+		bb = bb | (bb << np.uint64(shift))
+	return bb
+
+def _south_fill(bb):
+	for shift in (8, 16, 32):
+		bb = bb | (bb >> np.uint64(shift))
+	return bb
+
+def _spread(bb):
+	return bb | _shift(bb, EAST) | _shift(bb, WEST)
+
+# The pawn terms of the side moving north and its passed pawns, as in
+# pawns._white_terms. Black's come from the byte-swapped, mirrored boards.
+def _white_pawn_terms(own, enemy):
+	doubled = own & _south_fill(_shift(own, SOUTH))
+	files = _north_fill(own) | _south_fill(own)
+	isolated = own & ~(_shift(files, EAST) | _shift(files, WEST))
+
+	enemy_span = _spread(_south_fill(_shift(enemy, SOUTH)))
+	passed = own & ~enemy_span & ~doubled
+
+	enemy_attacks = _shift(_shift(enemy, EAST) | _shift(enemy, WEST), SOUTH)
+	support = _north_fill(_shift(own, EAST) | _shift(own, WEST))
+	backward = own & ~support & ~isolated & _shift(enemy_attacks, SOUTH)
+
+	mg = DOUBLED[0] * popcount(doubled) + ISOLATED[0] * popcount(isolated) + BACKWARD[0] * popcount(backward)
+	eg = DOUBLED[1] * popcount(doubled) + ISOLATED[1] * popcount(isolated) + BACKWARD[1] * popcount(backward)
+	for rank in range(1, 7):
+		count = popcount(passed & RANKS[rank])
+		mg = mg + PASSED_MG[rank] * count
+		eg = eg + PASSED_EG[rank] * count
+
+	return mg, eg, passed
+
+# Pawn structure, blocked passed pawns and king shields, white-relative
+def _pawn_scores(pieces):
+	white_pawns = pieces[:, BATCH_COLUMNS.index(('white', 'pawn'))]
+	black_pawns = pieces[:, BATCH_COLUMNS.index(('black', 'pawn'))]
+	white_king = pieces[:, BATCH_COLUMNS.index(('white', 'king'))]
+	black_king = pieces[:, BATCH_COLUMNS.index(('black', 'king'))]
+	white = np.bitwise_or.reduce(pieces[:, :len(BATCH_PIECES)], axis=1)
+	black = np.bitwise_or.reduce(pieces[:, len(BATCH_PIECES):], axis=1)
+
+	white_mg, white_eg, passed_white = _white_pawn_terms(white_pawns, black_pawns)
+	black_mg, black_eg, passed_black = _white_pawn_terms(black_pawns.byteswap(), white_pawns.byteswap())
+	passed_black = passed_black.byteswap()
+
+	blocked = popcount(_shift(passed_white, NORTH) & black) - popcount(_shift(passed_black, SOUTH) & white)
+
+	near = _spread(_shift(white_king, NORTH))
+	shield = SHIELD_NEAR * popcount(near & white_pawns) + SHIELD_FAR * popcount(_shift(near, NORTH) & white_pawns)
+	near = _spread(_shift(black_king, SOUTH))
+	shield = shield - SHIELD_NEAR * popcount(near & black_pawns) - SHIELD_FAR * popcount(_shift(near, SOUTH) & black_pawns)
+
+	mg = white_mg - black_mg + PASSED_BLOCKED[0] * blocked + shield
+	eg = white_eg - black_eg + PASSED_BLOCKED[1] * blocked
+	return mg, eg
+
+# Builds the batch arrays from Bitboard positions
+def to_arrays(positions):
+	pieces = np.zeros((len(positions), len(BATCH_COLUMNS)), dtype=np.uint64)
+	white_to_move = np.zeros(len(positions), dtype=bool)
+	for row, position in enumerate(positions):
+		for column, (color, piece) in enumerate(BATCH_COLUMNS):
+			pieces[row, column] = int(position.pieces[PIECE_BASE[COLORS.index(color)] + PIECE_CODES[piece]])
+		white_to_move[row] = position.turn == WHITE
+
+	return pieces, white_to_move
+
+# Tapered scores from the side to move's point of view, like Bitboard.evaluate
+def evaluate_batch(pieces, white_to_move):
+	pieces = np.asarray(pieces, dtype=np.uint64)
+	bits = np.unpackbits(pieces.astype('<u8').view(np.uint8).reshape(len(pieces), len(BATCH_COLUMNS), 8), axis=-1, bitorder='little')
+
+	pawn_mg, pawn_eg = _pawn_scores(pieces)
+	mg = np.einsum('nks,ks->n', bits, MG_ARRAY) + pawn_mg
+	eg = np.einsum('nks,ks->n', bits, EG_ARRAY) + pawn_eg
+	phase = np.minimum(popcount(pieces) @ PHASE_ARRAY, TOTAL_PHASE)
+
+	# Round toward zero, as evaluate.tapered does
+	score = mg * phase + eg * (TOTAL_PHASE - phase)
+	score = np.where(score >= 0, score // TOTAL_PHASE, -(-score // TOTAL_PHASE))
+	return np.where(white_to_move, score, -score)
+
+# Rays from every slider in one direction, up to and including the first
+# blocker. Sliders block each other, so no target square is counted for
+# two pieces.
+def _slide(sliders, empty, direction):
+	flood = sliders
+	ray = sliders
+	for step in range(6):
+		ray = _shift(ray, direction) & empty
+		flood = flood | ray
+
+	return _shift(flood, direction)
+
+def _pawn_moves(pawns, enemy, empty, white):
+	forward, left, right = (NORTH, NORTH_WEST, NORTH_EAST) if white else (SOUTH, SOUTH_WEST, SOUTH_EAST)
+	double_rank, last_rank = (RANK_3, RANK_8) if white else (RANK_6, RANK_1)
+
+	push = _shift(pawns, forward) & empty
+	double = _shift(push & double_rank, forward) & empty
+	captures = [_shift(pawns, left) & enemy, _shift(pawns, right) & enemy]
+
+	count = popcount(double)
+	for targets in [push] + captures:
+		count += popcount(targets & ~last_rank) + PROMOTIONS * popcount(targets & last_rank)
+
+	return count
+
+def _side_mobility(pieces, offset, own, enemy):
+	empty = ~(own | enemy)
+	not_own = ~own
+	white = offset == 0
+	pawn, knight, bishop, rook, queen, king = (pieces[:, offset + column] for column in range(len(BATCH_PIECES)))
+
+	count = _pawn_moves(pawn, enemy, empty, white)
+	for direction in KNIGHT_DIRECTIONS:
+		count += popcount(_shift(knight, direction) & not_own)
+	for direction in KING_DIRECTIONS:
+		count += popcount(_shift(king, direction) & not_own)
+	for direction in ROOK_DIRECTIONS:
+		count += popcount(_slide(rook, empty, direction) & not_own) + popcount(_slide(queen, empty, direction) & not_own)
+	for direction in BISHOP_DIRECTIONS:
+		count += popcount(_slide(bishop, empty, direction) & not_own) + popcount(_slide(queen, empty, direction) & not_own)
+
+	return count
+
+# Pseudo-legal move counts for white and for black, as if each side were
+# on move. Castling and en passant need state the bitboards don't carry
+# and are left out. A promotion counts once per promotion piece, like the
+# generator.
+def mobility_batch(pieces):
+	pieces = np.asarray(pieces, dtype=np.uint64)
+	white = np.bitwise_or.reduce(pieces[:, :len(BATCH_PIECES)], axis=1)
+	black = np.bitwise_or.reduce(pieces[:, len(BATCH_PIECES):], axis=1)
+	return _side_mobility(pieces, 0, white, black), _side_mobility(pieces, len(BATCH_PIECES), black, white)
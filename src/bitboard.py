@@ -1,24 +1,68 @@
 from collections import namedtuple
-from copy import copy, deepcopy
-from gmpy2 import mpz, bit_scan1
+from copy import copy
+from bitops import BIT, EMPTY, MASK_64, board, lsb, mask64, popcount, squares
+from attacks import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, BETWEEN, LINE, bishop_attacks, rook_attacks, queen_attacks
+from zobrist import ZOBRIST_PIECES, ZOBRIST_CASTLING, ZOBRIST_EN_PASSANT, ZOBRIST_WHITE_TO_MOVE
+from evaluate import MG_PST, EG_PST, PHASE_WEIGHTS, tapered
+from pawns import blocked, pawn_structure, shield
+from move import MOVE_PIECES, PIECE_CODES, PAWN, KNIGHT, BISHOP, ROOK, KING, QUEEN, FLAG_EN_PASSANT, FLAG_CASTLING, FLAG_DOUBLE_PUSH, encode_move, move_buffer
 import logging
-import pdb
 
 BitboardFields = ['pawn', 'knight', 'bishop', 'rook', 'king', 'queen']
 BitboardSymbols = ['', 'N', 'B', 'R', 'K', 'Q']
 BitboardFiles = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']
-
-Move = namedtuple('Move', [
-	'piece',
-	'start_pos',
-	'end_pos',
-	'is_check',
-	'is_promotion',
-	'capture',
-	'attacks'
+BitboardPromotions = ['queen', 'knight', 'rook', 'bishop']
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# Colors are indices, so flipping the side is turn ^ 1
+WHITE = 0
+BLACK = 1
+COLORS = ['white', 'black']
+
+# Piece codes in material order, the ones a position's boards are indexed by
+PIECE_CODE_LIST = [PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING]
+
+PIECE_VALUES = {
+	'pawn': 100,
+	'knight': 320,
+	'bishop': 330,
+	'rook': 500,
+	'king': 0,
+	'queen': 900
+}
+
+# Cheapest first, the order pieces recapture in during an exchange
+SEE_ORDER = [PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING]
+
+# The name-keyed tables other modules build, as lists indexed by color and
+# piece code so make_move never hashes a string. Code 0 is no piece.
+def _by_code(table):
+	return [[table[color][MOVE_PIECES[code]] if code else None for code in range(len(MOVE_PIECES))] for color in COLORS]
+
+PIECE_KEYS = _by_code(ZOBRIST_PIECES)
+MG_SQUARES = _by_code(MG_PST)
+EG_SQUARES = _by_code(EG_PST)
+PHASE_BY_CODE = [PHASE_WEIGHTS[piece_name] if piece_name else 0 for piece_name in MOVE_PIECES]
+VALUE_BY_CODE = [PIECE_VALUES[piece_name] if piece_name else 0 for piece_name in MOVE_PIECES]
+PAWN_ATTACKS_BY_COLOR = [PAWN_ATTACKS[color] for color in COLORS]
+
+# Everything make_move needs to put the position back: the move itself,
+# which carries the moved and captured pieces, and the irreversible state
+# it overwrote
+Undo = namedtuple('Undo', [
+	'move',
+	'castling',
+	'en_passant',
+	'hash',
+	'pawn_key',
+	'mg',
+	'eg',
+	'phase',
+	'halfmove'
 ])
 
-MASK_RANK_1 = mpz(255)
+MASK_RANK_1 = board(255)
 MASK_RANK_2 = MASK_RANK_1<<8
 MASK_RANK_3 = MASK_RANK_1<<16
 MASK_RANK_4 = MASK_RANK_1<<24
@@ -27,7 +71,9 @@ MASK_RANK_6 = MASK_RANK_1<<40
 MASK_RANK_7 = MASK_RANK_1<<48
 MASK_RANK_8 = MASK_RANK_1<<56
 
-MASK_FILE_A = mpz(1)<<7 | mpz(1)<<15 | mpz(1)<<23 | mpz(1)<<31 | mpz(1)<<39 | mpz(1)<<47 | mpz(1)<<55 | mpz(1)<<63
+ALL_SQUARES = board(MASK_64)
+
+MASK_FILE_A = BIT[7] | BIT[15] | BIT[23] | BIT[31] | BIT[39] | BIT[47] | BIT[55] | BIT[63]
 MASK_FILE_B = MASK_FILE_A>>1
 MASK_FILE_C = MASK_FILE_A>>2
 MASK_FILE_D = MASK_FILE_A>>3
@@ -36,75 +82,189 @@ MASK_FILE_F = MASK_FILE_A>>5
 MASK_FILE_G = MASK_FILE_A>>6
 MASK_FILE_H = MASK_FILE_A>>7
 
-KNIGHT_MASK = 0
-
+CASTLE_WHITE_KING = 1
+CASTLE_WHITE_QUEEN = 2
+CASTLE_BLACK_KING = 4
+CASTLE_BLACK_QUEEN = 8
+
+CASTLING_SYMBOLS = {
+	'K': CASTLE_WHITE_KING,
+	'Q': CASTLE_WHITE_QUEEN,
+	'k': CASTLE_BLACK_KING,
+	'q': CASTLE_BLACK_QUEEN
+}
+
+# (right, king from, king to, squares that must be empty, squares that
+# must not be attacked), indexed by color
+CASTLING_MOVES = [
+	[
+		(CASTLE_WHITE_KING, 3, 1, [2, 1], [3, 2, 1]),
+		(CASTLE_WHITE_QUEEN, 3, 5, [4, 5, 6], [3, 4, 5])
+	],
+	[
+		(CASTLE_BLACK_KING, 59, 57, [58, 57], [59, 58, 57]),
+		(CASTLE_BLACK_QUEEN, 59, 61, [60, 61, 62], [59, 60, 61])
+	]
+]
+
+# Castling rights lost when a piece moves from or to these squares (bit index)
+CASTLING_RIGHTS_LOST = {
+	3: CASTLE_WHITE_KING | CASTLE_WHITE_QUEEN,
+	0: CASTLE_WHITE_KING,
+	7: CASTLE_WHITE_QUEEN,
+	59: CASTLE_BLACK_KING | CASTLE_BLACK_QUEEN,
+	56: CASTLE_BLACK_KING,
+	63: CASTLE_BLACK_QUEEN
+}
+
+# Rook (from, to) squares keyed by the square a castling king lands on
+CASTLING_ROOK_MOVES = {
+	1: (0, 2),
+	5: (7, 4),
+	57: (56, 58),
+	61: (63, 60)
+}
+
+class FenError(ValueError):
+	pass
+
+FEN_PIECES = 'PNBRQKpnbrqk'
+
+# Raises FenError unless the fields are a FEN (or EPD) position the board
+# can be built from. Only the syntax and the kings are checked, not
+# whether the position could come up in a game.
+def _check_fen(fields):
+	if not 4 <= len(fields) <= 6:
+		raise FenError('expected 4 to 6 fields, got %d' % len(fields))
+
+	placement, on_move, castling, en_passant = fields[:4]
+	ranks = placement.split('/')
+	if len(ranks) != 8:
+		raise FenError('expected 8 ranks, got %d' % len(ranks))
+	for rank in ranks:
+		width = 0
+		for symbol in rank:
+			if symbol in '12345678':
+				width += int(symbol)
+			elif symbol in FEN_PIECES:
+				width += 1
+			else:
+				raise FenError('bad piece %r' % symbol)
+		if width != 8:
+			raise FenError('rank %r is not 8 squares' % rank)
+	if placement.count('K') != 1 or placement.count('k') != 1:
+		raise FenError('each side needs exactly one king')
+
+	if on_move not in ('w', 'b'):
+		raise FenError('bad side to move %r' % on_move)
+	if castling != '-' and (not castling or any(symbol not in CASTLING_SYMBOLS or castling.count(symbol) > 1 for symbol in castling)):
+		raise FenError('bad castling rights %r' % castling)
+	if en_passant != '-' and (len(en_passant) != 2 or en_passant[0] not in BitboardFiles or en_passant[1] not in '36'):
+		raise FenError('bad en passant square %r' % en_passant)
+	for counter in fields[4:]:
+		if not counter.isdigit():
+			raise FenError('bad move counter %r' % counter)
+
+# pieces is one flat list of boards indexed by PIECE_BASE[color] plus the
+# move piece code: white's are at their codes, pieces[PAWN], black's from
+# 8. Slots 0 and 7 stay empty.
+PIECE_BASE = [0, len(MOVE_PIECES)]
+
+# A chess position. The twelve piece bitboards are absolute, white and
+# black, and indexed by color and move piece code: pieces[PIECE_BASE[WHITE] + PAWN].
+# The occupancy of each color and of the whole board is kept up to date by
+# make_move/unmake_move instead of being OR-ed together on every use.
+# Slots keep the object small and attribute access fast.
 class Bitboard:
-	@staticmethod
-	def start_white():
-		return dict(
-			pawn = mpz(255<<8),
-			knight = mpz(66),
-			bishop = mpz(36),
-			rook = mpz(129),
-			king = mpz(8),
-			queen = mpz(16)
-		)
-
-	@staticmethod
-	def start_black():
-		return dict(
-			pawn = mpz(255<<48),
-			knight = mpz(66<<56),
-			bishop = mpz(36<<56),
-			rook = mpz(129<<56),
-			king = mpz(8<<56),
-			queen = mpz(16<<56)
-		)
+	__slots__ = [
+		'pieces',
+		'occupied',
+		'occupancy',
+		'turn',
+		'castling',
+		'en_passant',
+		'hash_key',
+		'pawn_key',
+		'mg',
+		'eg',
+		'phase',
+		'halfmove',
+		'fullmove',
+		'history'
+	]
+
+	def __init__(self, fen=START_FEN):
+		fields = fen.split()
+		_check_fen(fields)
+		placement, on_move, castling, en_passant = fields[:4]
+
+		self.pieces = [EMPTY] * (2 * len(MOVE_PIECES))
+		for rank_index, rank in enumerate(placement.split('/')):
+			rank_number = 8 - rank_index
+			file_index = 0
+			for symbol in rank:
+				if symbol.isdigit():
+					file_index += int(symbol)
+					continue
+
+				piece_name = 'pawn' if symbol.upper() == 'P' else BitboardFields[BitboardSymbols.index(symbol.upper())]
+				color = WHITE if symbol.isupper() else BLACK
+				self.pieces[PIECE_BASE[color] + PIECE_CODES[piece_name]] |= BIT[8 * (rank_number - 1) + 7 - file_index]
+				file_index += 1
+
+		self.occupied = [self._color_occupancy(WHITE), self._color_occupancy(BLACK)]
+		self.occupancy = self.occupied[WHITE] | self.occupied[BLACK]
+		self.turn = WHITE if on_move == 'w' else BLACK
+		self.castling = 0
+		for symbol in castling:
+			self.castling |= CASTLING_SYMBOLS.get(symbol, 0)
+		self.en_passant = EMPTY if en_passant == '-' else BIT[8 * (int(en_passant[1]) - 1) + 7 - BitboardFiles.index(en_passant[0])]
+		# The move counters are optional, as in EPD
+		self.halfmove = int(fields[4]) if len(fields) > 4 else 0
+		self.fullmove = int(fields[5]) if len(fields) > 5 else 1
+		self.history = []
+		self.hash_key = self._zobrist()
+		self.pawn_key = self._pawn_zobrist()
+		self._score()
 
 	@staticmethod
-	def defaults(color):
-		return {
-			'color': color,
-			'player': Bitboard.start_white() if color == 'white' else Bitboard.start_black(),
-			'opponent': Bitboard.start_black() if color == 'white' else Bitboard.start_white(),
-			'on_move': color == 'white',
-			'history': [],
-			'future_pos': False
-		}
-
-	def __init__(self, color, state=None):
-		self.state = state if state else Bitboard.defaults(color)
+	def from_fen(fen):
+		return Bitboard(fen)
 
 	def __repr__(self):
-		return self._format(self._pos_bb())
+		return self._format(self.occupancy)
 
+	# Boards are immutable, copying the lists is enough
 	def __copy__(self):
-		copiable_state = {
-			'color': self.state['color'],
-			'player': copy(self.state['player']),
-			'opponent': copy(self.state['opponent']),
-			'on_move': self.state['on_move'],
-			'history': [],
-			'future_pos': True
-		}
-
-		return Bitboard(self.state['color'], copiable_state)
+		board = Bitboard.__new__(Bitboard)
+		board.pieces = list(self.pieces)
+		board.occupied = list(self.occupied)
+		board.occupancy = self.occupancy
+		board.turn = self.turn
+		board.castling = self.castling
+		board.en_passant = self.en_passant
+		board.hash_key = self.hash_key
+		board.pawn_key = self.pawn_key
+		board.mg = self.mg
+		board.eg = self.eg
+		board.phase = self.phase
+		board.halfmove = self.halfmove
+		board.fullmove = self.fullmove
+		board.history = list(self.history)
+		return board
 
 	def _clone(self):
 		return copy(self)
 
-	def _pos_bb(self, board=None):
-		if board is None:
-			return (self._pos_bb(self.state['player']) ^ self._pos_bb(self.state['opponent']))
-		else:
-			all = mpz(0)
-			for item in board:
-				all = all ^ board[item]
+	def _color_occupancy(self, color):
+		occupancy = EMPTY
+		for code in PIECE_CODE_LIST:
+			occupancy |= self.pieces[PIECE_BASE[color] + code]
 
-			return all
+		return occupancy
 
 	def _format(self, board):
-		digits = board.digits(2).rjust(64, '0')
+		digits = format(int(board), '064b')
 		index = 0
 		formatted = ''
 		while index < 64:
@@ -112,380 +272,731 @@ class Bitboard:
 			index += 8
 		return formatted
 
-	# Shifts an absolute mask relative to a bitboard
-	def _shift_abs(self, num, shift):
-		return num<<shift if self.state['color'] == 'white' else (num<<(64 - shift))>>shift
-
-	# Shifts a position relative to a bitboard
+	# Shifts a position forward for the side on move
 	def _shift(self, num, shift):
-		return num<<shift if self.state['color'] == 'white' else num>>shift
+		return num<<shift if self.turn == WHITE else num>>shift
 
+	# 64-bit Zobrist key of the position, kept up to date by make_move
 	def hash(self):
-		hash = 0
-		for index in range(len(BitboardFields)):
-			key = BitboardFields[index]
-			hash += (getattr(self.state['player'], key) | getattr(self.state['opponent'], key)) * (index + 1)
-
-		return hash.digits(10)
+		return self.hash_key
+
+	# Computes the Zobrist key from scratch
+	def _zobrist(self):
+		key = 0
+		for color in (WHITE, BLACK):
+			for code in PIECE_CODE_LIST:
+				for sq in squares(self.pieces[PIECE_BASE[color] + code]):
+					key ^= PIECE_KEYS[color][code][sq]
+
+		key ^= ZOBRIST_CASTLING[self.castling] ^ self._zobrist_en_passant()
+		if self.turn == WHITE:
+			key ^= ZOBRIST_WHITE_TO_MOVE
+
+		return key
+
+	# Zobrist key of the pawns alone, the pawn hash table's key
+	def _pawn_zobrist(self):
+		key = 0
+		for color in (WHITE, BLACK):
+			for sq in squares(self.pieces[PIECE_BASE[color] + PAWN]):
+				key ^= PIECE_KEYS[color][PAWN][sq]
+
+		return key
+
+	# Computes the evaluation sums from scratch, make_move keeps them up to date
+	def _score(self):
+		mg = eg = phase = 0
+		for color in (WHITE, BLACK):
+			for code in PIECE_CODE_LIST:
+				for sq in squares(self.pieces[PIECE_BASE[color] + code]):
+					mg += MG_SQUARES[color][code][sq]
+					eg += EG_SQUARES[color][code][sq]
+					phase += PHASE_BY_CODE[code]
+
+		self.mg = mg
+		self.eg = eg
+		self.phase = phase
+
+	# Like Polyglot, only hash the en-passant file when a pawn can take there
+	def _zobrist_en_passant(self):
+		ep = self.en_passant
+		if ep:
+			sq = lsb(ep)
+			if PAWN_ATTACKS_BY_COLOR[self.turn ^ 1][sq] & self.pieces[PIECE_BASE[self.turn] + PAWN]:
+				return ZOBRIST_EN_PASSANT[sq & 7]
+
+		return 0
 
 	def bb_from_algebraic(self, file, rank):
 		file_index = 7 - BitboardFiles.index(file.lower())
-		return mpz(1)<<((8 * (int(rank) - 1)) + file_index)
+		return BIT[8 * (int(rank) - 1) + file_index]
+
+	def _square_name(self, sq):
+		return BitboardFiles[7 - (sq & 7)] + str((sq >> 3) + 1)
+
+	# Move encoding code of color's piece on sq, 0 for none
+	def _piece_code_at(self, sq, color):
+		pos = BIT[sq]
+		if not self.occupied[color] & pos:
+			return 0
+
+		base = PIECE_BASE[color]
+		for code in PIECE_CODE_LIST:
+			if self.pieces[base + code] & pos:
+				return code
+
+	def _piece_attacks(self, code, sq, color, occupancy):
+		if code == PAWN:
+			return PAWN_ATTACKS_BY_COLOR[color][sq]
+		elif code == KNIGHT:
+			return KNIGHT_ATTACKS[sq]
+		elif code == KING:
+			return KING_ATTACKS[sq]
+		elif code == BISHOP:
+			return bishop_attacks(sq, occupancy)
+		elif code == ROOK:
+			return rook_attacks(sq, occupancy)
+		else:
+			return queen_attacks(sq, occupancy)
+
+	# Captures the moved piece would have from its new square, as moves.
+	# Nothing in move generation needs these, so they are only worked out
+	# on request. A pawn also counts an enemy pawn still on its start square
+	# beside it as attacked, with the en passant capture that would answer
+	# its double push. Empty for an illegal move.
+	def move_attacks(self, move):
+		color = self.turn
+		if not self.make_move(move):
+			return []
+
+		enemy = self.turn
+		code = (move >> 18) & 7 or (move >> 12) & 7
+		sq = (move >> 6) & 63
+		attacked = self._piece_attacks(code, sq, color, self.occupancy)
+		attacks = [
+			encode_move(sq, to_sq, code, self._piece_code_at(to_sq, enemy))
+			for to_sq in squares(attacked & self.occupied[enemy])
+		]
+
+		if code == PAWN:
+			# A double push crosses the square we attack and lands beside us
+			step = 8 if color == WHITE else -8
+			for to_sq in squares(attacked & ~self.occupancy):
+				landing = to_sq - step
+				if 0 <= to_sq + step < 64 and self.pieces[PIECE_BASE[enemy] + PAWN] & BIT[to_sq + step] and not self.occupancy & BIT[landing] and landing >> 3 == sq >> 3:
+					attacks.append(encode_move(sq, to_sq, PAWN, PAWN, flag=FLAG_EN_PASSANT))
+
+		self.unmake_move()
+		return attacks
+
+	# Finds the legal move matching XBoard coordinate notation, or None
+	def create_move_from_algebraic_coords(self, notation):
+		if notation in ('O-O', 'O-O-O'):
+			rank = '1' if self.turn == WHITE else '8'
+			notation = 'e' + rank + ('g' if notation == 'O-O' else 'c') + rank
 
-	def _rank_index(self, pos):
-		rank = 0
-		for i in range(8):
-			if(pos & (MASK_RANK_1<<(8 * i))):
-				rank = i + 1
-				break
+		for move in self.moves():
+			if self.as_algebraic_coords(move) == notation:
+				return move
 
-		return rank
+		return None
 
-	def _rank(self, pos):
-		return str(self._rank_index(pos));
+	# Plays a move in place, pushing an undo record onto the history
+	def make_move(self, move):
+		color = self.turn
+		other = color ^ 1
+		pieces = self.pieces
+		us = PIECE_BASE[color]
+		them = PIECE_BASE[other]
+
+		from_sq = move & 63
+		to_sq = (move >> 6) & 63
+		piece = (move >> 12) & 7
+		capture = (move >> 15) & 7
+		promotion = (move >> 18) & 7 or piece
+		flag = (move >> 21) & 3
+		from_pos = BIT[from_sq]
+		to_pos = BIT[to_sq]
+
+		if not (pieces[us + piece] & from_pos):
+			logging.error('Impossible move:' + self.as_algebraic_coords(move))
+			logging.error(move)
+			return False
+
+		self.history.append(Undo(move, self.castling, self.en_passant, self.hash_key, self.pawn_key, self.mg, self.eg, self.phase, self.halfmove))
+
+		keys = PIECE_KEYS[color]
+		mg_squares = MG_SQUARES[color]
+		eg_squares = EG_SQUARES[color]
+		hash = self.hash_key ^ ZOBRIST_CASTLING[self.castling] ^ self._zobrist_en_passant()
+		mg = self.mg + mg_squares[promotion][to_sq] - mg_squares[piece][from_sq]
+		eg = self.eg + eg_squares[promotion][to_sq] - eg_squares[piece][from_sq]
+
+		pieces[us + piece] ^= from_pos
+		pieces[us + promotion] |= to_pos
+		self.occupied[color] ^= from_pos | to_pos
+		hash ^= keys[piece][from_sq] ^ keys[promotion][to_sq]
+		self.phase += PHASE_BY_CODE[promotion] - PHASE_BY_CODE[piece]
+		if piece == PAWN:
+			self.pawn_key ^= keys[PAWN][from_sq]
+			if promotion == PAWN:
+				self.pawn_key ^= keys[PAWN][to_sq]
+
+		if capture:
+			capture_sq = self._capture_sq(to_sq, flag)
+			capture_pos = BIT[capture_sq]
+			pieces[them + capture] ^= capture_pos
+			self.occupied[other] ^= capture_pos
+			hash ^= PIECE_KEYS[other][capture][capture_sq]
+			mg -= MG_SQUARES[other][capture][capture_sq]
+			eg -= EG_SQUARES[other][capture][capture_sq]
+			self.phase -= PHASE_BY_CODE[capture]
+			if capture == PAWN:
+				self.pawn_key ^= PIECE_KEYS[other][PAWN][capture_sq]
+
+		if flag == FLAG_CASTLING:
+			rook_from, rook_to = CASTLING_ROOK_MOVES[to_sq]
+			rook_move = BIT[rook_from] | BIT[rook_to]
+			pieces[us + ROOK] ^= rook_move
+			self.occupied[color] ^= rook_move
+			hash ^= keys[ROOK][rook_from] ^ keys[ROOK][rook_to]
+			mg += mg_squares[ROOK][rook_to] - mg_squares[ROOK][rook_from]
+			eg += eg_squares[ROOK][rook_to] - eg_squares[ROOK][rook_from]
+
+		self.occupancy = self.occupied[WHITE] | self.occupied[BLACK]
+		self.mg = mg
+		self.eg = eg
+		self.castling &= ~(CASTLING_RIGHTS_LOST.get(from_sq, 0) | CASTLING_RIGHTS_LOST.get(to_sq, 0))
+
+		if flag == FLAG_DOUBLE_PUSH:
+			self.en_passant = BIT[(from_sq + to_sq) // 2]
+		else:
+			self.en_passant = EMPTY
+
+		self.halfmove = 0 if capture or piece == PAWN else self.halfmove + 1
+		if color == BLACK:
+			self.fullmove += 1
+
+		self.turn = other
+		self.hash_key = hash ^ ZOBRIST_CASTLING[self.castling] ^ self._zobrist_en_passant() ^ ZOBRIST_WHITE_TO_MOVE
+		return True
+
+	# Takes back the last move played with make_move
+	def unmake_move(self):
+		undo = self.history.pop()
+		move = undo.move
+
+		self.turn ^= 1
+		self.castling = undo.castling
+		self.en_passant = undo.en_passant
+		self.hash_key = undo.hash
+		self.pawn_key = undo.pawn_key
+		self.mg = undo.mg
+		self.eg = undo.eg
+		self.phase = undo.phase
+		self.halfmove = undo.halfmove
+		if self.turn == BLACK:
+			self.fullmove -= 1
+
+		color = self.turn
+		pieces = self.pieces
+		us = PIECE_BASE[color]
+
+		from_sq = move & 63
+		to_sq = (move >> 6) & 63
+		piece = (move >> 12) & 7
+		capture = (move >> 15) & 7
+		promotion = (move >> 18) & 7 or piece
+		flag = (move >> 21) & 3
+		from_pos = BIT[from_sq]
+		to_pos = BIT[to_sq]
+
+		pieces[us + promotion] ^= to_pos
+		pieces[us + piece] |= from_pos
+		self.occupied[color] ^= from_pos | to_pos
+
+		if capture:
+			capture_pos = BIT[self._capture_sq(to_sq, flag)]
+			pieces[PIECE_BASE[color ^ 1] + capture] |= capture_pos
+			self.occupied[color ^ 1] |= capture_pos
+
+		if flag == FLAG_CASTLING:
+			rook_from, rook_to = CASTLING_ROOK_MOVES[to_sq]
+			rook_move = BIT[rook_from] | BIT[rook_to]
+			pieces[us + ROOK] ^= rook_move
+			self.occupied[color] ^= rook_move
+
+		self.occupancy = self.occupied[WHITE] | self.occupied[BLACK]
+		return move
+
+	# The square a capture removes a piece from. En passant takes the pawn
+	# one rank behind the target square, which flipping bit 3 of the index
+	# reaches for both colors.
+	def _capture_sq(self, to_sq, flag):
+		return to_sq ^ 8 if flag == FLAG_EN_PASSANT else to_sq
+
+	# Fills buffer with the legal moves for the side on move and returns how
+	# many there are
+	def generate(self, buffer):
+		return self.generate_quiets(buffer, self.generate_captures(buffer))
+
+	# Captures, en passant and promotions, written from buffer[count]
+	def generate_captures(self, buffer, count=0):
+		return self._generate(buffer, count, True)
+
+	# Everything else: non-promoting pushes, quiet piece moves and castling
+	def generate_quiets(self, buffer, count=0):
+		return self._generate(buffer, count, False)
+
+	# Only legal moves come out. In check, pieces other than the king may only
+	# capture the checker or block its line, and in double check only the
+	# king moves. Pinned pieces stay on the line through their king, and the
+	# king only steps to squares that are safe once it has left its own.
+	def _generate(self, buffer, count, captures):
+		pieces = self.pieces
+		us = PIECE_BASE[self.turn]
+		king, checkers, pinned = self._check_info()
+		targets = self.occupied[self.turn ^ 1] if captures else mask64(~self.occupancy)
+
+		count = self._moves_from_targets(KING, king, self._king_targets(king, targets), buffer, count)
+		if checkers:
+			if popcount(checkers) > 1:
+				return count
+			evasions = BETWEEN[king][lsb(checkers)] | checkers
+		else:
+			evasions = ALL_SQUARES
+
+		pawn_moves = self._captures_pawn if captures else self._quiets_pawn
+		count = pawn_moves(pieces[us + PAWN] & ~pinned, evasions, buffer, count)
+		for sq in squares(pieces[us + PAWN] & pinned):
+			count = pawn_moves(BIT[sq], evasions & LINE[king][sq], buffer, count)
+
+		for code, piece_moves in ((KNIGHT, self._moves_knight), (BISHOP, self._moves_bishop), (ROOK, self._moves_rook), (QUEEN, self._moves_queen)):
+			count = piece_moves(pieces[us + code] & ~pinned, targets & evasions, buffer, count)
+			for sq in squares(pieces[us + code] & pinned):
+				count = piece_moves(BIT[sq], targets & evasions & LINE[king][sq], buffer, count)
+
+		if not captures and not checkers:
+			count = self._moves_castling(buffer, count)
+
+		return count
+
+	# (king square, pieces giving check, our pinned pieces) for the side on move
+	def _check_info(self):
+		pieces = self.pieces
+		them = PIECE_BASE[self.turn ^ 1]
+		king = lsb(pieces[PIECE_BASE[self.turn] + KING])
+		occupancy = self.occupancy
+		diagonal = pieces[them + BISHOP] | pieces[them + QUEEN]
+		straight = pieces[them + ROOK] | pieces[them + QUEEN]
+
+		checkers = (
+			PAWN_ATTACKS_BY_COLOR[self.turn][king] & pieces[them + PAWN] |
+			KNIGHT_ATTACKS[king] & pieces[them + KNIGHT] |
+			bishop_attacks(king, occupancy) & diagonal |
+			rook_attacks(king, occupancy) & straight
+		)
 
-	def _file_index(self, pos):
-		file = 0
-		for i in range(8):
-			if(pos & (MASK_FILE_A>>i)):
-				file = i + 1
-				break
+		# Sliders that would see the king if our pieces weren't there pin
+		# the one piece of ours in between
+		pos_them = self.occupied[self.turn ^ 1]
+		snipers = bishop_attacks(king, pos_them) & diagonal | rook_attacks(king, pos_them) & straight
+		pinned = EMPTY
+		for sniper in squares(snipers):
+			blockers = BETWEEN[king][sniper] & occupancy
+			if blockers and popcount(blockers) == 1:
+				pinned |= blockers
+
+		return king, checkers, pinned
+
+	# Squares among targets the king can step to without being attacked,
+	# looking through the king itself so it can't retreat along a checking ray
+	def _king_targets(self, king, targets):
+		other = self.turn ^ 1
+		occupancy = self.occupancy ^ BIT[king]
+		safe = EMPTY
+		for sq in squares(KING_ATTACKS[king] & targets):
+			if not self._square_attacked(sq, other, occupancy):
+				safe |= BIT[sq]
+
+		return safe
+
+	def moves(self):
+		buffer = move_buffer()
+		count = self.generate(buffer)
+		return buffer[:count].tolist()
+
+	# Could move have been generated in this position, ignoring checks? Used
+	# to vet moves that come from elsewhere, like the transposition table,
+	# without generating the whole list.
+	def is_pseudo_legal(self, move):
+		from_sq = move & 63
+		to_sq = (move >> 6) & 63
+		piece = (move >> 12) & 7
+		if not piece or not self.pieces[PIECE_BASE[self.turn] + piece] & BIT[from_sq]:
+			return False
+
+		flag = (move >> 21) & 3
+		if piece == PAWN or flag == FLAG_CASTLING:
+			# Few enough moves to just generate them for this one piece
+			buffer = move_buffer()
+			if flag == FLAG_CASTLING:
+				count = self._moves_castling(buffer, 0)
+			else:
+				pawn = BIT[from_sq]
+				count = self._quiets_pawn(pawn, ALL_SQUARES, buffer, self._captures_pawn(pawn, ALL_SQUARES, buffer, 0))
+			return move in buffer[:count]
+
+		if (move >> 18) & 7 or self._piece_code_at(to_sq, self.turn ^ 1) != (move >> 15) & 7:
+			return False
+
+		attacks = self._piece_attacks(piece, from_sq, self.turn, self.occupancy)
+		return bool(attacks & ~self.occupied[self.turn] & BIT[to_sq])
+
+	def is_legal(self, move):
+		if not self.is_pseudo_legal(move):
+			return False
+
+		self.make_move(move)
+		legal = not self.left_in_check()
+		self.unmake_move()
+		return legal
+
+	def _moves_from_targets(self, piece, from_sq, targets, buffer, count):
+		other = self.turn ^ 1
+		for to_sq in squares(targets):
+			buffer[count] = encode_move(from_sq, to_sq, piece, self._piece_code_at(to_sq, other))
+			count += 1
+
+		return count
+
+	def _quiets_pawn(self, pawns, evasions, buffer, count):
+		start_rank = MASK_RANK_2 if self.turn == WHITE else MASK_RANK_7
+		inv_pos_all = mask64(~self.occupancy)
+
+		for from_sq in squares(pawns):
+			pawn = BIT[from_sq]
+			push = self._shift(pawn, 8) & inv_pos_all
+			if push and not push & (MASK_RANK_1 | MASK_RANK_8):
+				if push & evasions:
+					buffer[count] = encode_move(from_sq, lsb(push), PAWN)
+					count += 1
+
+				push_2 = self._shift(push, 8) & inv_pos_all & evasions if pawn & start_rank else 0
+				if push_2:
+					buffer[count] = encode_move(from_sq, lsb(push_2), PAWN, 0, 0, FLAG_DOUBLE_PUSH)
+					count += 1
+
+		return count
+
+	def _moves_pawn_targets(self, from_sq, targets, buffer, count):
+		other = self.turn ^ 1
+		for to_sq in squares(targets):
+			capture = self._piece_code_at(to_sq, other)
+			if BIT[to_sq] & (MASK_RANK_1 | MASK_RANK_8):
+				for promotion in BitboardPromotions:
+					buffer[count] = encode_move(from_sq, to_sq, PAWN, capture, PIECE_CODES[promotion])
+					count += 1
+			else:
+				buffer[count] = encode_move(from_sq, to_sq, PAWN, capture)
+				count += 1
 
-		return file
+		return count
 
-	def _file(self, pos):
-		return BitboardFiles[self._file_index(pos) - 1]
+	def _captures_pawn(self, pawns, evasions, buffer, count):
+		pawn_attacks = PAWN_ATTACKS_BY_COLOR[self.turn]
+		inv_pos_all = mask64(~self.occupancy)
+		pos_opp = self.occupied[self.turn ^ 1]
 
-	def _piece_at(self, pos, side):
-		found = None
-		for piece_name in side:
-			if(side[piece_name] & pos):
-				found = piece_name
-				break
+		for from_sq in squares(pawns):
+			attacks = pawn_attacks[from_sq]
+			promotion_push = self._shift(BIT[from_sq], 8) & inv_pos_all & (MASK_RANK_1 | MASK_RANK_8)
+			count = self._moves_pawn_targets(from_sq, ((attacks & pos_opp) | promotion_push) & evasions, buffer, count)
 
-		return found
+			# En passant moves two pawns off one rank, which can uncover
+			# a check no mask describes, so just try it
+			if attacks & self.en_passant:
+				move = encode_move(from_sq, lsb(self.en_passant), PAWN, PAWN, 0, FLAG_EN_PASSANT)
+				self.make_move(move)
+				legal = not self.left_in_check()
+				self.unmake_move()
+				if legal:
+					buffer[count] = move
+					count += 1
 
-	def _next_pos_attacks(self, move):
-		evil_twin = self._clone()
-		evil_twin.make_move(move)
+		return count
 
-		pos_opp = evil_twin._pos_bb(evil_twin.state['opponent'])
-		piece = move.piece
-		attacks = []
-		if(piece == 'pawn'):
-			# TODO: en passant counts as "attacked"
-			evil_twin._captures_pawn(move.end_pos, evil_twin._pos_bb(evil_twin.state['opponent']), attacks)
-		else:
-			getattr(evil_twin, '_moves_' + piece)(move.end_pos, attacks)
+	def _moves_knight(self, knights, targets, buffer, count):
+		for from_sq in squares(knights):
+			count = self._moves_from_targets(KNIGHT, from_sq, KNIGHT_ATTACKS[from_sq] & targets, buffer, count)
 
-		return [i for i in attacks if i.end_pos & pos_opp]
+		return count
 
-	def create_move(self, piece_name, initial, final, capture=None, promotion=None):
-		side = self.state['player'] if self.state['on_move'] else self.state['opponent']
-		check = self.is_check(final)
-		if self.state['future_pos']:
-			attacks = None
-		else:
-			attacks = self._next_pos_attacks(Move(piece_name, initial, final, check, promotion, capture, None))
-		return Move(piece_name, initial, final, check, promotion, capture, attacks)
-
-	def _create_moves_horizontal(self, piece_name, piece_pos, pos_us, pos_opp, file, moves):
-		# Search left and right of piece
-		self._create_moves_sliding(piece_name, file, 'left', 1, piece_pos, pos_us, pos_opp, moves)
-		self._create_moves_sliding(piece_name, 9 - file, 'right', 1, piece_pos, pos_us, pos_opp, moves)
-
-	def _create_moves_vertical(self, piece_name, piece_pos, pos_us, pos_opp, rank, moves):
-		# Search up and down of piece
-		self._create_moves_sliding(piece_name, rank, 'right', 8, piece_pos, pos_us, pos_opp, moves)
-		self._create_moves_sliding(piece_name, 9 - rank, 'left', 8, piece_pos, pos_us, pos_opp, moves)
-
-	def _create_moves_diagonal_right(self, piece_name, piece_pos, pos_us, pos_opp, file, rank, moves):
-		# Search up-right and down-left of piece
-		dist_up_right = min(8 - rank, 8 - file)
-		dist_down_left = min(rank, file)
-		self._create_moves_sliding(piece_name, dist_up_right, 'left', 7, piece_pos, pos_us, pos_opp, moves)
-		self._create_moves_sliding(piece_name, dist_down_left, 'right', 7, piece_pos, pos_us, pos_opp, moves)
-
-	def _create_moves_diagonal_left(self, piece_name, piece_pos, pos_us, pos_opp, file, rank, moves):
-		# Search up-left and down-right of piece
-		dist_up_left = min(8 - rank, file)
-		dist_down_right = min(rank, 8 - file)
-		self._create_moves_sliding(piece_name, dist_up_left, 'left', 9, piece_pos, pos_us, pos_opp, moves)
-		self._create_moves_sliding(piece_name, dist_down_right, 'right', 9, piece_pos, pos_us, pos_opp, moves)
-
-	def _create_moves_sliding(self, piece_name, iterations, shift_direction, shift_amount, initial_pos, pos_us, pos_opp, moves):
-		for i in range(1, iterations):
-			if shift_direction == 'left':
-				final_pos = initial_pos<<(shift_amount * i)
-			else:
-				final_pos = initial_pos>>(shift_amount * i)
+	def _moves_sliding(self, code, pieces, attacks, targets, buffer, count):
+		occupancy = self.occupancy
 
-			if(pos_us & final_pos):
-				break
-			else:
-				if(pos_opp & final_pos):
-					self._move_append_if(piece_name, initial_pos, final_pos, moves)
-					break
-				else:
-					self._move_append_if(piece_name, initial_pos, final_pos, moves)
+		for from_sq in squares(pieces):
+			count = self._moves_from_targets(code, from_sq, attacks(from_sq, occupancy) & targets, buffer, count)
 
-	def create_move_from_algebraic_coords(self, notation):
-		# TODO: O-O, O-O-O
-		start_file = notation[0]
-		start_rank = notation[1]
-		end_file = notation[2]
-		end_rank = notation[3]
+		return count
 
-		start_pos = self.bb_from_algebraic(start_file, start_rank)
-		end_pos = self.bb_from_algebraic(end_file, end_rank)
-		side = self.state['player'] if self.state['on_move'] else self.state['opponent']
-		other_side = self.state['opponent'] if self.state['on_move'] else self.state['player']
-		piece = self._piece_at(start_pos, side)
+	def _moves_bishop(self, bishops, targets, buffer, count):
+		return self._moves_sliding(BISHOP, bishops, bishop_attacks, targets, buffer, count)
 
-		return self.create_move(piece, start_pos, end_pos, self._piece_at(end_pos, other_side))
+	def _moves_rook(self, rooks, targets, buffer, count):
+		return self._moves_sliding(ROOK, rooks, rook_attacks, targets, buffer, count)
 
-	def make_move(self, move):
-		if not self.state['future_pos']:
-			self.state['history'].append(self._clone())
+	def _moves_castling(self, buffer, count):
+		occupancy = self.occupancy
+		other = self.turn ^ 1
 
-		on_move_bb = self.state['player'] if self.state['on_move'] else self.state['opponent']
-		piece_bb = on_move_bb[move.piece]
+		for right, king_from, king_to, empty, safe in CASTLING_MOVES[self.turn]:
+			if not self.castling & right:
+				continue
+			if any(occupancy & BIT[sq] for sq in empty):
+				continue
+			if any(self._square_attacked(sq, other) for sq in safe):
+				continue
 
-		if not (piece_bb & move.start_pos):
-			logging.error('Impossible move:' + self.as_algebraic_coords(move))
-			logging.error(move)
-			return
-
-		# TODO: Promotions, castling
-		on_move_bb[move.piece] = piece_bb & ~move.start_pos | move.end_pos
-
-		if(move.capture):
-			off_move_bb = self.state['opponent'] if self.state['on_move'] else self.state['player']
-			cap_piece_bb = off_move_bb[move.capture]
-			off_move_bb[move.capture] = cap_piece_bb & ~move.end_pos
-
-		if not self.state['future_pos']:
-			self.state['on_move'] = not self.state['on_move']
-
-	def moves(self, side=None):
-		side = side or self.state['player']
-		moves = []
-
-		for move_list in map(lambda key: getattr(self, '_moves_' + key)(side[key], moves), BitboardFields):
-			pass
-
-		return moves
-
-	def _move_bb_gen(self, pieces_bb):
-		index = -1
-		while(1):
-			index = bit_scan1(pieces_bb, index + 1)
-			if index is None: raise StopIteration
-			yield mpz(1)<<index
-
-	def _move_append_if(self, piece_name, initial_pos, final_pos, moves):
-		if(final_pos):
-			capture = self._piece_at(final_pos, self.state['opponent'])
-			moves.append(self.create_move(piece_name, initial_pos, final_pos, capture))
-
-	def _moves_pawn(self, pawns, moves):
-		prev_pos = self.state['history'][:-2] if len(self.state['history']) > 1 else None
-
-		rank_mask_rel = self._shift_abs(255, 8)
-		moved_pawns = pawns & ~rank_mask_rel
-		unmoved_pawns = pawns & rank_mask_rel
-
-		inv_pos_us = ~self._pos_bb()
-		pos_opp = self._pos_bb(self.state['opponent'])
-
-		def _pawn_move_1(pawn):
-			return self._shift(pawn, 8) & inv_pos_us
-
-		def _pawn_move_2(pawn):
-			move_1 = _pawn_move_1(pawn)
-			return self._shift(move_1, 8) & inv_pos_us if move_1 else 0
-
-		def _pawn_promote(pawn):
-			return _pawn_move_1(pawn) & rank_mask_rel
-
-		for pawn in self._move_bb_gen(pawns):
-			self._move_append_if('pawn', pawn, _pawn_move_1(pawn), moves)
-			self._captures_pawn(pawn, pos_opp, moves)
-		
-		for pawn in self._move_bb_gen(unmoved_pawns):
-			self._move_append_if('pawn', pawn, _pawn_move_2(pawn), moves)
-
-	def _captures_pawn(self, pawn, pos_opp, moves):
-		def _pawn_capture_left(pawn):
-			return self._shift(pawn & ~MASK_FILE_A, 9) & pos_opp
-
-		def _pawn_capture_right(pawn):
-			return self._shift(pawn & ~MASK_FILE_H, 7) & pos_opp
-
-		def _pawn_en_passant(pawn):
-			# TODO: En passant
-			pass
-
-		# TODO: Promotion can generate an attack
-
-		self._move_append_if('pawn', pawn, _pawn_capture_left(pawn), moves)
-		self._move_append_if('pawn', pawn, _pawn_capture_right(pawn), moves)
-
-	def _moves_knight(self, knights, moves):
-		def _knight_move_left_down(knight):
-			on_ab_files = knight & (MASK_FILE_A | MASK_FILE_B)
-			on_first_rank = knight & MASK_RANK_1
-			return knight>>6 & inv_pos_us if not (on_ab_files or on_first_rank) else 0
-		def _knight_move_left_up(knight):
-			on_ab_files = knight & (MASK_FILE_A | MASK_FILE_B)
-			on_last_rank = knight & MASK_RANK_8
-			return knight<<10 & inv_pos_us if not (on_ab_files or on_last_rank) else 0
-		def _knight_move_up_left(knight):
-			on_first_file = knight & MASK_FILE_A
-			on_78_rank = knight & (MASK_RANK_7 | MASK_RANK_8)
-			return knight<<17 & inv_pos_us if not (on_first_file or on_78_rank) else 0
-		def _knight_move_up_right(knight):
-			on_last_file = knight & MASK_FILE_H
-			on_78_rank = knight & (MASK_RANK_7 | MASK_RANK_8)
-			return knight<<15 & inv_pos_us if not (on_last_file or on_78_rank) else 0
-		def _knight_move_right_up(knight):
-			on_gh_files = knight & (MASK_FILE_G | MASK_FILE_H)
-			on_last_rank = knight & MASK_RANK_8
-			return knight<<6 & inv_pos_us if not (on_gh_files or on_last_rank) else 0
-		def _knight_move_right_down(knight):
-			on_gh_files = knight & (MASK_FILE_G | MASK_FILE_H)
-			on_first_rank = knight & MASK_RANK_1
-			return knight>>10 & inv_pos_us if not (on_gh_files or on_first_rank) else 0
-		def _knight_move_down_right(knight):
-			on_last_file = knight & MASK_FILE_H
-			on_12_rank = knight & (MASK_RANK_1 | MASK_RANK_2)
-			return knight>>17 & inv_pos_us if not (on_last_file or on_12_rank) else 0
-		def _knight_move_down_left(knight):
-			on_first_file = knight & MASK_FILE_A
-			on_12_rank = knight & (MASK_RANK_1 | MASK_RANK_2)
-			return knight>>15 & inv_pos_us if not (on_first_file or on_12_rank) else 0
-
-		inv_pos_us = ~self._pos_bb(self.state['player'])
-
-		for knight in self._move_bb_gen(knights):
-			self._move_append_if('knight', knight, _knight_move_left_down(knight), moves)
-			self._move_append_if('knight', knight, _knight_move_left_up(knight), moves)
-			self._move_append_if('knight', knight, _knight_move_up_left(knight), moves)
-			self._move_append_if('knight', knight, _knight_move_up_right(knight), moves)
-			self._move_append_if('knight', knight, _knight_move_right_up(knight), moves)
-			self._move_append_if('knight', knight, _knight_move_right_down(knight), moves)
-			self._move_append_if('knight', knight, _knight_move_down_right(knight), moves)
-			self._move_append_if('knight', knight, _knight_move_down_left(knight), moves)
-
-	def _moves_bishop(self, bishops, moves):
-		pos_us = self._pos_bb(self.state['player'])
-		pos_opp = self._pos_bb(self.state['opponent'])
-
-		for bishop in self._move_bb_gen(bishops):
-			rank = self._rank_index(bishop)
-			file = self._file_index(bishop)
-
-			self._create_moves_diagonal_right('bishop', bishop, pos_us, pos_opp, file, rank, moves)
-			self._create_moves_diagonal_left('bishop', bishop, pos_us, pos_opp, file, rank, moves)
-
-	def _moves_rook(self, rooks, moves):
-		pos_us = self._pos_bb(self.state['player'])
-		pos_opp = self._pos_bb(self.state['opponent'])
-
-		for rook in self._move_bb_gen(rooks):
-			rank = self._rank_index(rook)
-			file = self._file_index(rook)
-
-			self._create_moves_vertical('rook', rook, pos_us, pos_opp, rank, moves)
-			self._create_moves_horizontal('rook', rook, pos_us, pos_opp, file, moves)
-
-	def _moves_king(self, kings, moves):
-		def _king_move_left_down(king):
-			on_first_file = king & MASK_FILE_A
-			on_first_rank = king & MASK_RANK_1
-			return (king>>7) & inv_pos_us if not (on_first_file or on_first_rank) else 0
-		def _king_move_left(king):
-			on_first_file = king & MASK_FILE_A
-			return (king<<1) & inv_pos_us if not on_first_file else 0
-		def _king_move_left_up(king):
-			on_first_file = king & MASK_FILE_A
-			on_last_rank = king & MASK_RANK_8
-			return (king<<7) & inv_pos_us if not (on_first_file or on_last_rank) else 0
-		def _king_move_up(king):
-			on_last_rank = king & MASK_RANK_8
-			return (king<<8) & inv_pos_us if not on_last_rank else 0
-		def _king_move_right_up(king):
-			on_last_file = king & MASK_FILE_H
-			on_last_rank = king & MASK_RANK_8
-			return (king<<9) & inv_pos_us if not (on_last_file or on_last_rank) else 0
-		def _king_move_right(king):
-			on_last_file = king & MASK_FILE_H
-			return (king>>1) & inv_pos_us if not on_last_file else 0
-		def _king_move_right_down(king):
-			on_last_file = king & MASK_FILE_H
-			on_first_rank = king & MASK_RANK_1
-			return (king>>9) & inv_pos_us if not (on_last_file or on_first_rank) else 0
-		def _king_move_down(king):
-			on_first_rank = king & MASK_RANK_1
-			return (king>>8) & inv_pos_us if not on_first_rank else 0
-
-		inv_pos_us = ~self._pos_bb(self.state['player'])
-
-		for king in self._move_bb_gen(kings):
-			self._move_append_if('king', king, _king_move_left_down(king), moves)
-			self._move_append_if('king', king, _king_move_left(king), moves)
-			self._move_append_if('king', king, _king_move_left_up(king), moves)
-			self._move_append_if('king', king, _king_move_up(king), moves)
-			self._move_append_if('king', king, _king_move_right_up(king), moves)
-			self._move_append_if('king', king, _king_move_right(king), moves)
-			self._move_append_if('king', king, _king_move_right_down(king), moves)
-			self._move_append_if('king', king, _king_move_down(king), moves)
-
-	def _moves_queen(self, queens, moves):
-		pos_us = self._pos_bb(self.state['player'])
-		pos_opp = self._pos_bb(self.state['opponent'])
-
-		for queen in self._move_bb_gen(queens):
-			rank = self._rank_index(queen)
-			file = self._file_index(queen)
-
-			self._create_moves_vertical('queen', queen, pos_us, pos_opp, rank, moves)
-			self._create_moves_horizontal('queen', queen, pos_us, pos_opp, file, moves)
-			self._create_moves_diagonal_right('queen', queen, pos_us, pos_opp, file, rank, moves)
-			self._create_moves_diagonal_left('queen', queen, pos_us, pos_opp, file, rank, moves)
+			buffer[count] = encode_move(king_from, king_to, KING, 0, 0, FLAG_CASTLING)
+			count += 1
+
+		return count
+
+	def _moves_queen(self, queens, targets, buffer, count):
+		return self._moves_sliding(QUEEN, queens, queen_attacks, targets, buffer, count)
 
+	# Does move give check?
 	def is_check(self, move):
+		self.make_move(move)
+		check = self.in_check()
+		self.unmake_move()
+		return check
+
+	# Is sq attacked by color's pieces?
+	def _square_attacked(self, sq, color, occupancy=None):
+		if occupancy is None:
+			occupancy = self.occupancy
+		pieces = self.pieces
+		base = PIECE_BASE[color]
+		return bool(
+			PAWN_ATTACKS_BY_COLOR[color ^ 1][sq] & pieces[base + PAWN] or
+			KNIGHT_ATTACKS[sq] & pieces[base + KNIGHT] or
+			KING_ATTACKS[sq] & pieces[base + KING] or
+			bishop_attacks(sq, occupancy) & (pieces[base + BISHOP] | pieces[base + QUEEN]) or
+			rook_attacks(sq, occupancy) & (pieces[base + ROOK] | pieces[base + QUEEN])
+		)
+
+	# Every piece of either color in occupancy that attacks sq. Sliders
+	# look through anything not in occupancy.
+	def _attackers_to(self, sq, occupancy):
+		pieces = self.pieces
+		black = PIECE_BASE[BLACK]
+		diagonal = pieces[BISHOP] | pieces[QUEEN] | pieces[black + BISHOP] | pieces[black + QUEEN]
+		straight = pieces[ROOK] | pieces[QUEEN] | pieces[black + ROOK] | pieces[black + QUEEN]
+		attackers = (
+			PAWN_ATTACKS_BY_COLOR[BLACK][sq] & pieces[PAWN] |
+			PAWN_ATTACKS_BY_COLOR[WHITE][sq] & pieces[black + PAWN] |
+			KNIGHT_ATTACKS[sq] & (pieces[KNIGHT] | pieces[black + KNIGHT]) |
+			KING_ATTACKS[sq] & (pieces[KING] | pieces[black + KING]) |
+			bishop_attacks(sq, occupancy) & diagonal |
+			rook_attacks(sq, occupancy) & straight
+		)
+
+		return attackers & occupancy
+
+	# Static exchange evaluation: the material the side on move wins by
+	# playing move and then trading on the target square, each side
+	# recapturing with its least valuable piece and free to stop whenever
+	# carrying on would lose more. Pieces are taken off an occupancy
+	# bitboard, never moved, so sliders lined up behind a capturer join in.
+	def see(self, move):
+		from_sq = move & 63
+		to_sq = (move >> 6) & 63
+		capture = (move >> 15) & 7
+		promotion = (move >> 18) & 7
+
+		occupancy = self.occupancy ^ BIT[from_sq]
+		if (move >> 21) & 3 == FLAG_EN_PASSANT:
+			occupancy ^= BIT[self._capture_sq(to_sq, FLAG_EN_PASSANT)]
+
+		gains = [VALUE_BY_CODE[capture]]
+		if promotion:
+			gains[0] += VALUE_BY_CODE[promotion] - VALUE_BY_CODE[PAWN]
+		on_square = VALUE_BY_CODE[promotion or (move >> 12) & 7]
+
+		color = self.turn ^ 1
+		attackers = self._attackers_to(to_sq, occupancy)
+		while True:
+			ours = attackers & self.occupied[color]
+			if not ours:
+				break
+
+			base = PIECE_BASE[color]
+			code = next(code for code in SEE_ORDER if ours & self.pieces[base + code])
+			# The king can only take last
+			if code == KING and attackers & ~ours:
+				break
+
+			gains.append(on_square - gains[-1])
+			on_square = VALUE_BY_CODE[code]
+			attacker = ours & self.pieces[base + code]
+			occupancy ^= attacker & -attacker
+			attackers = self._attackers_to(to_sq, occupancy)
+			color ^= 1
+
+		# Back up the sequence, each side taking the better of stopping or capturing
+		while len(gains) > 1:
+			gain = gains.pop()
+			gains[-1] = -max(-gains[-1], gain)
+
+		return gains[0]
+
+	# Is the side on move in check?
+	def in_check(self):
+		king = lsb(self.pieces[PIECE_BASE[self.turn] + KING])
+		return self._square_attacked(king, self.turn ^ 1)
+
+	# Did the last move leave the mover's own king attacked?
+	def left_in_check(self):
+		king = lsb(self.pieces[PIECE_BASE[self.turn ^ 1] + KING])
+		return self._square_attacked(king, self.turn)
+
+	# Has the current position occurred before since the last irreversible move?
+	def is_repetition(self):
+		key = self.hash_key
+		for undo in reversed(self.history):
+			if undo.hash == key:
+				return True
+			if (undo.move >> 15) & 7 or (undo.move >> 12) & 7 == PAWN:
+				break
+
 		return False
 
+	# Score for the side to move. Pawn structure comes from the pawn hash
+	# table when one is given, and is computed on the spot otherwise.
+	def evaluate(self, pawns=None):
+		pieces = self.pieces
+		white_pawns = pieces[PAWN]
+		black_pawns = pieces[PIECE_BASE[BLACK] + PAWN]
+		if pawns is not None:
+			pawn_mg, pawn_eg, passed_white, passed_black = pawns.probe(self.pawn_key, white_pawns, black_pawns)
+		else:
+			pawn_mg, pawn_eg, passed_white, passed_black = pawn_structure(white_pawns, black_pawns)
+
+		blocked_mg, blocked_eg = blocked(passed_white, passed_black, self.occupied[WHITE], self.occupied[BLACK])
+		shield_mg = shield(white_pawns, black_pawns, lsb(pieces[KING]), lsb(pieces[PIECE_BASE[BLACK] + KING]))
+		mg = self.mg + pawn_mg + blocked_mg + shield_mg
+		eg = self.eg + pawn_eg + blocked_eg
+
+		score = tapered(mg, eg, self.phase)
+		return score if self.turn == WHITE else -score
+
 	def algebraic_coords(self, moves):
 		return list(map(self.as_algebraic_coords, moves))
 
 	def as_algebraic_coords(self, move):
-		# buf = ''
-		start_file = self._file(move.start_pos)
-		start_rank = self._rank(move.start_pos)
-		end_rank = self._rank(move.end_pos)
-		end_file = self._file(move.end_pos)
-
-		return start_file + start_rank + end_file + end_rank
+		promotion = MOVE_PIECES[(move >> 18) & 7]
+		suffix = BitboardSymbols[BitboardFields.index(promotion)].lower() if promotion else ''
+
+		return self._square_name(move & 63) + self._square_name((move >> 6) & 63) + suffix
+
+	# Standard algebraic notation, with a + or # suffix for check and mate
+	def as_san(self, move):
+		from_sq = move & 63
+		to_sq = (move >> 6) & 63
+		piece = MOVE_PIECES[(move >> 12) & 7]
+		promotion = MOVE_PIECES[(move >> 18) & 7]
+		flag = (move >> 21) & 3
+
+		if flag == FLAG_CASTLING:
+			san = 'O-O' if to_sq & 7 < 3 else 'O-O-O'
+		elif piece == 'pawn':
+			san = self._square_name(from_sq)[0] + 'x' if (move >> 15) & 7 else ''
+			san += self._square_name(to_sq)
+			if promotion:
+				san += '=' + BitboardSymbols[BitboardFields.index(promotion)]
+		else:
+			san = BitboardSymbols[BitboardFields.index(piece)]
+			# Name the file, then the rank, then both, whatever tells the
+			# other pieces that could go to the same square apart
+			others = [other & 63 for other in self.moves() if (other >> 6) & 63 == to_sq and (other >> 12) & 7 == (move >> 12) & 7 and other & 63 != from_sq]
+			if others:
+				name = self._square_name(from_sq)
+				if all(self._square_name(other)[0] != name[0] for other in others):
+					san += name[0]
+				elif all(self._square_name(other)[1] != name[1] for other in others):
+					san += name[1]
+				else:
+					san += name
+			if (move >> 15) & 7:
+				san += 'x'
+			san += self._square_name(to_sq)
+
+		self.make_move(move)
+		if self.in_check():
+			san += '+' if self.moves() else '#'
+		self.unmake_move()
+		return san
+
+	# The legal move a SAN string stands for, or None. Check marks and
+	# annotations are ignored, and so are the x and the = of a promotion,
+	# which some sources leave out.
+	def create_move_from_san(self, notation):
+		notation = self._bare_san(notation.rstrip('!?').replace('0', 'O'))
+		for move in self.moves():
+			if self._bare_san(self.as_san(move)) == notation:
+				return move
 
-	def from_fen(self):
 		return None
 
+	def _bare_san(self, notation):
+		return notation.rstrip('+#').replace('x', '').replace('=', '')
+
 	def to_fen(self):
-		return None
+		ranks = []
+		for rank in range(7, -1, -1):
+			placement = ''
+			empty = 0
+			for file_index in range(8):
+				sq = rank * 8 + 7 - file_index
+				symbol = None
+				for color in (WHITE, BLACK):
+					code = self._piece_code_at(sq, color)
+					if code:
+						symbol = 'P' if code == PAWN else BitboardSymbols[BitboardFields.index(MOVE_PIECES[code])]
+						symbol = symbol if color == WHITE else symbol.lower()
+
+				if symbol:
+					placement += (str(empty) if empty else '') + symbol
+					empty = 0
+				else:
+					empty += 1
+			ranks.append(placement + (str(empty) if empty else ''))
+
+		castling = ''.join(symbol for symbol in 'KQkq' if self.castling & CASTLING_SYMBOLS[symbol])
+		en_passant = self._square_name(lsb(self.en_passant)) if self.en_passant else '-'
+
+		return ' '.join([
+			'/'.join(ranks),
+			'w' if self.turn == WHITE else 'b',
+			castling or '-',
+			en_passant,
+			str(self.halfmove),
+			str(self.fullmove)
+		])
 
 if __name__ == "__main__":
 	iterations = 10000
 	import timeit
-	print(timeit.timeit(stmt="b.moves()", setup="from __main__ import Bitboard;b=Bitboard('white')", number=iterations) / iterations)
+	print(timeit.timeit(stmt="b.moves()", setup="from __main__ import Bitboard;b=Bitboard()", number=iterations) / iterations)
 
 	# import cProfile
-	# b = Bitboard('white')
+	# b = Bitboard()
 	# cProfile.run('for t in range(0, iterations): b.moves()', sort='tottime')
 
-	# b = Bitboard('white')
+	# b = Bitboard()
 	# moves = b.moves()
 	# print(list(moves))
 	# print(list(b.algebraic_coords(moves)))
-	# list(map(lambda m: print(b._format(m.end_pos)), b.moves()))
+	# list(map(lambda m: print(b._format(BIT[(m >> 6) & 63])), b.moves()))
@@ -0,0 +1,56 @@
+import os
+
+# Bit operations on 64-bit boards. Boards are native Python ints unless
+# DERPFISH_BITOPS=gmpy2 asks for gmpy2's mpz. The backend is fixed at import,
+# every table and position is built with it, so it has to be set before the
+# engine modules load (derpfish --bitops does that).
+
+BACKENDS = ['int', 'gmpy2']
+BACKEND = os.environ.get('DERPFISH_BITOPS') or 'int'
+if BACKEND not in BACKENDS:
+	raise ValueError('unknown bit operation backend %r, expected one of %s' % (BACKEND, ', '.join(BACKENDS)))
+
+MASK_64 = (1<<64) - 1
+
+if BACKEND == 'gmpy2':
+	from gmpy2 import mpz as board, bit_scan1, popcount
+
+	# Index of the lowest set bit, bb must not be empty
+	def lsb(bb):
+		return bit_scan1(bb)
+
+	# Yields the index of every set bit, lowest first
+	def squares(bb):
+		index = bit_scan1(bb)
+		while index is not None:
+			yield index
+			index = bit_scan1(bb, index + 1)
+else:
+	board = int
+
+	# int.bit_count is Python 3.10+
+	if hasattr(int, 'bit_count'):
+		def popcount(bb):
+			return bb.bit_count()
+	else:
+		def popcount(bb):
+			return bin(bb).count('1')
+
+	# x & -x isolates the lowest set bit
+	def lsb(bb):
+		return (bb & -bb).bit_length() - 1
+
+	def squares(bb):
+		while bb:
+			low = bb & -bb
+			yield low.bit_length() - 1
+			bb ^= low
+
+EMPTY = board(0)
+
+# BIT[sq] is the board with only sq set, cheaper than building 1<<sq each time
+BIT = [board(1)<<sq for sq in range(64)]
+
+# Drops the bits a left shift pushed past the 64th
+def mask64(bb):
+	return bb & MASK_64
@@ -0,0 +1,103 @@
+from bitboard import PIECE_BASE
+from move import KING
+import logging, mmap, random, struct
+
+logger = logging.getLogger('book')
+
+# Polyglot entries are 16 big-endian bytes: key, move, weight, learn,
+# sorted by key
+ENTRY = struct.Struct('>QHHI')
+KEY = struct.Struct('>Q')
+
+PROMOTION_SYMBOLS = ['', 'n', 'b', 'r', 'q']
+
+# Polyglot writes castling as the king taking its own rook
+CASTLING_NOTATION = {
+	'e1h1': 'e1g1',
+	'e1a1': 'e1c1',
+	'e8h8': 'e8g8',
+	'e8a8': 'e8c8'
+}
+
+# Polyglot squares count a1 = 0 along the ranks
+def _square_name(square):
+	return 'abcdefgh'[square & 7] + str((square >> 3) + 1)
+
+# Polyglot .bin opening book. The file is memory mapped and searched in
+# place, so opening even a large book costs nothing up front and a lookup
+# only touches the pages the binary search lands on. Our Zobrist keys are
+# the Polyglot ones, so positions are looked up by Bitboard.hash().
+class PolyglotBook:
+	def __init__(self, path):
+		self.path = path
+		self.file = open(path, 'rb')
+		self.entries = 0
+		self.map = None
+		size = self.file.seek(0, 2)
+		if size >= ENTRY.size:
+			self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+			self.entries = size // ENTRY.size
+
+	def close(self):
+		if self.map is not None:
+			self.map.close()
+			self.map = None
+		self.file.close()
+
+	def _key_at(self, index):
+		return KEY.unpack_from(self.map, index * ENTRY.size)[0]
+
+	# Index of the first entry with this key, or of the first one after it
+	def _lower_bound(self, key):
+		low = 0
+		high = self.entries
+		while low < high:
+			middle = (low + high) // 2
+			if self._key_at(middle) < key:
+				low = middle + 1
+			else:
+				high = middle
+
+		return low
+
+	# [(coordinate notation, weight)] for the position's key
+	def entries_for(self, key):
+		found = []
+		index = self._lower_bound(key)
+		while index < self.entries:
+			entry_key, move, weight, learn = ENTRY.unpack_from(self.map, index * ENTRY.size)
+			if entry_key != key:
+				break
+
+			notation = _square_name((move >> 6) & 63) + _square_name(move & 63) + PROMOTION_SYMBOLS[(move >> 12) & 7]
+			found.append((notation, weight))
+			index += 1
+
+		return found
+
+	# Picks a book move for the position at random, in proportion to the
+	# weights. Returns None when the position is not in the book.
+	def choose(self, position):
+		if not self.entries:
+			return None
+
+		candidates = []
+		for notation, weight in self.entries_for(position.hash()):
+			if notation in CASTLING_NOTATION:
+				king = position.bb_from_algebraic(notation[0], notation[1]) & position.pieces[PIECE_BASE[position.turn] + KING]
+				notation = CASTLING_NOTATION[notation] if king else notation
+
+			move = position.create_move_from_algebraic_coords(notation)
+			if move is not None:
+				candidates.append((move, weight))
+
+		if not candidates:
+			return None
+
+		weights = [weight for move, weight in candidates]
+		if not any(weights):
+			weights = None
+
+		move = random.choices([move for move, weight in candidates], weights)[0]
+		logger.debug('book: %d moves, playing %s' % (len(candidates), position.as_algebraic_coords(move)))
+		return move
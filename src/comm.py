@@ -1,5 +1,5 @@
 from collections import namedtuple
-import logging, os, re, sys
+import logging, os, queue, re, sys, threading
 
 XBoardEvent = namedtuple('XBoardEvent', ['command', 'args'])
 
@@ -10,17 +10,28 @@ class XBoard:
 		self.move_exp = '[a-h]\d[a-h]\d[qnbr]?$|O-O$|O-O-O$'
 		self.features = {
 			'analyze': '0',
+			'memory': '1',
 			'myname': '"Derpfish"',
-			# 'ping': '1',
+			'ping': '1',
+			'setboard': '1',
+			# Commands arrive while we think anyway, signals would only kill us
+			'sigint': '0',
+			'smp': '1',
 			'variants': '"normal"'
 		}
 		self.accepted = {}
+		# Called before answering ping, returns once the engine has sent any
+		# move it is thinking about: pong must not overtake it
+		self.before_pong = None
 		self.log = []
 		self.subs = {
 			'protover': [self._on_protover],
 			'accepted': [self._on_accepted],
-			# 'ping': [self._on_ping]
+			'ping': [self._on_ping]
 		}
+		# Lines from the reader thread, None once stdin closes
+		self.lines = queue.Queue()
+		self.output_lock = threading.Lock()
 
 	def _parse_line(self, line):
 		move_match = re.match(self.move_exp, line)
@@ -59,14 +70,19 @@ class XBoard:
 		self.send('feature done=1')
 
 	def _on_ping(self, event):
+		if self.before_pong:
+			self.before_pong()
+
 		if(len(event.args)):
 			self.send('pong ' + event.args[0])
 		else:
 			self.send('pong')
 
+	# Called from the search thread as well as the main one
 	def send(self, data):
-		logger.debug('>>> ' + data)
-		print(data, end=os.linesep)
+		with self.output_lock:
+			logger.debug('>>> ' + data)
+			print(data, end=os.linesep, flush=True)
 
 	def on(self, event, callback):
 		try:
@@ -77,10 +93,31 @@ class XBoard:
 
 		subs.append(callback)
 
+	# Reads through a second file object on the same descriptor. Worker
+	# processes close sys.stdin on startup, which would deadlock on the
+	# lock this thread holds while it waits for input if it used sys.stdin.
+	def _read(self):
+		for line in open(sys.stdin.fileno(), closefd=False):
+			self.lines.put(line)
+
+		self.lines.put(None)
+
+	# stdin is read on its own thread and handlers run here, so commands
+	# keep being handled while the engine thinks on its search thread.
+	# Returns on quit or when stdin closes.
 	def listen(self):
-		for line in sys.stdin:
+		reader = threading.Thread(target=self._read, name='xboard-reader', daemon=True)
+		reader.start()
+
+		while True:
+			line = self.lines.get()
+			if line is None:
+				break
+
 			parsed = self._parse_line(line)
 			if(parsed):
 				logger.debug('<<< ' + line)
 				logger.debug(parsed)
-				self._fire(parsed)
\ No newline at end of file
+				self._fire(parsed)
+				if parsed.command == 'quit':
+					break
@@ -1,9 +1,15 @@
-import argparse, logging, sys, traceback
+import argparse, logging, os, sys, traceback
 
 # CL args
 parser = argparse.ArgumentParser(description='Derpfish, a derpy chess engine')
 parser.add_argument('-d', '--debug', dest='debug', action='store_true')
 parser.add_argument('--log-file', dest='logfile', default='derpfish.log')
+parser.add_argument('--hash', dest='hash_mb', type=int, default=16, help='transposition table size in MB')
+parser.add_argument('--book', dest='book', help='Polyglot opening book (.bin)')
+parser.add_argument('--cores', dest='cores', type=int, default=1, help='search processes, until XBoard sends cores')
+parser.add_argument('--stats', dest='stats', help='append a JSON record of every search to this file')
+parser.add_argument('--profile', dest='profile', help='write cProfile stats of all searches to this file on exit')
+parser.add_argument('--bitops', dest='bitops', choices=['int', 'gmpy2'], help='bit operation backend, defaults to $DERPFISH_BITOPS or int')
 args = parser.parse_args()
 
 # Set logging level
@@ -13,19 +19,42 @@ logging.basicConfig(filename=args.logfile, level=level)
 logger = logging.getLogger('derpfish')
 logger.info('Derpfish starting...')
 
+# Must be set before bitops is first imported
+if args.bitops:
+	os.environ['DERPFISH_BITOPS'] = args.bitops
+
 from comm import XBoard
 from engine import Engine
+from bitops import BACKEND
+logger.info('bit operations: %s' % BACKEND)
 
 try:
 	engine_input = XBoard()
-	engine = Engine()
+	engine = Engine(args.hash_mb, args.cores, args.book, args.stats, args.profile)
 	engine.set_output(engine_input)
+	engine_input.before_pong = engine.wait_for_move
 
 	engine_input.on('new', lambda evt: engine.new())
 	engine_input.on('move', lambda evt: engine.user_move(evt.args[0]))
+	engine_input.on('setboard', lambda evt: engine.set_board(' '.join(evt.args)))
 	engine_input.on('go', lambda evt: engine.go())
+	engine_input.on('force', lambda evt: engine.force())
+	engine_input.on('?', lambda evt: engine.move_now())
+	engine_input.on('result', lambda evt: engine.result())
+	engine_input.on('hard', lambda evt: engine.set_ponder(True))
+	engine_input.on('easy', lambda evt: engine.set_ponder(False))
+	engine_input.on('post', lambda evt: engine.set_post(True))
+	engine_input.on('nopost', lambda evt: engine.set_post(False))
+	engine_input.on('memory', lambda evt: engine.set_memory(int(evt.args[0])))
+	engine_input.on('cores', lambda evt: engine.set_cores(int(evt.args[0])))
+	engine_input.on('level', lambda evt: engine.clock.level(*evt.args))
+	engine_input.on('st', lambda evt: engine.clock.set_fixed_time(evt.args[0]))
+	engine_input.on('sd', lambda evt: engine.clock.set_max_depth(evt.args[0]))
+	engine_input.on('time', lambda evt: engine.clock.set_remaining(evt.args[0]))
+	engine_input.on('otim', lambda evt: engine.clock.set_opponent_remaining(evt.args[0]))
 
 	engine_input.listen()
+	engine.close()
 except:
 	etype, evalue, tb = sys.exc_info()
 	logger.error(''.join(traceback.format_exception(etype, evalue, tb)))
@@ -1,8 +1,59 @@
-from bitboard import Bitboard, Move
-import random
+from bitboard import Bitboard, FenError
+from book import PolyglotBook
+from pawns import PawnTable
+from search import Search, MATE, MAX_PLY
+from timecontrol import TimeControl
+from tt import TranspositionTable, DEFAULT_SIZE_MB
+import json, logging, threading
 
+logger = logging.getLogger('engine')
+
+# XBoard shows mate scores as 100000 + moves to mate
+def _xboard_score(score):
+	if score > MATE - MAX_PLY:
+		return 100000 + (MATE - score + 1) // 2
+	elif score < -MATE + MAX_PLY:
+		return -100000 - (MATE + score) // 2
+	return score
+
+# stats names a file that gets one JSON record per search, profile one that
+# gets the cProfile stats of every search when the engine closes
 class Engine:
-	def __init__(self):
+	def __init__(self, hash_mb=DEFAULT_SIZE_MB, cores=1, book=None, stats=None, profile=None):
+		# The transposition table lives for the whole game and is only cleared on 'new'
+		self.tt = TranspositionTable(hash_mb)
+		self.pawns = PawnTable()
+		self.clock = TimeControl()
+		# Searches run on their own thread so XBoard commands are still
+		# handled meanwhile, stop ends the running one early
+		self.thread = None
+		self.stop = threading.Event()
+		self.discard = False
+		# Pondering searches the reply we expect on the opponent's time.
+		# ponder_over is set once the opponent's move shows whether it was right.
+		self.ponder = False
+		self.pondering = False
+		self.ponder_move = None
+		self.ponder_search = None
+		self.ponder_over = threading.Event()
+		# Clear while we think about our own move, set once it has been sent
+		self.moved = threading.Event()
+		self.moved.set()
+		self.cores = 1
+		self.smp = None
+		self.set_cores(cores)
+		self.book = None
+		if book:
+			self.set_book(book)
+		# post: send thinking output
+		self.post = False
+		self.record = None
+		self.stats_file = open(stats, 'a') if stats else None
+		self.profile_path = profile
+		self.profiler = None
+		if profile:
+			import cProfile
+			self.profiler = cProfile.Profile()
 		self.reset()
 
 	def set_output(self, output):
@@ -10,33 +61,261 @@ class Engine:
 
 	def reset(self):
 		self.position = None
-		self.first_move_made = False
+		self.moves_made = 0
+		self.forced = False
 
 	def new(self):
-		self.position = Bitboard('black')
+		self.abort()
+		self.position = Bitboard()
+		self.moves_made = 0
+		self.forced = False
+		self.tt.clear()
+		self.pawns.clear()
+		# new drops any depth limit sd set, the clock settings stay
+		self.clock.max_depth = None
+
+	# setboard: play on from any position, the game history is gone. A
+	# position we can't read leaves the old one in place.
+	def set_board(self, fen):
+		self.abort()
+		try:
+			position = Bitboard.from_fen(fen)
+		except FenError as error:
+			logger.warning('setboard %s: %s' % (fen, error))
+			self.output.send('tellusererror Illegal position')
+			return
+
+		self.position = position
+		self.moves_made = 0
+
+	def set_memory(self, size_mb):
+		self.abort()
+		if size_mb != self.tt.size_mb:
+			self.tt.resize(size_mb)
+			# The helpers still map the old table
+			if self.smp:
+				self._start_smp()
+
+	# More than one core searches with helper processes sharing the table
+	def set_cores(self, cores):
+		self.abort()
+		cores = max(1, cores)
+		if cores == self.cores and (cores == 1 or self.smp):
+			return
+
+		self.cores = cores
+		if self.tt.shared != (cores > 1):
+			size_mb = self.tt.size_mb
+			self.tt.close(unlink=True)
+			self.tt = TranspositionTable(size_mb, shared=cores > 1)
+
+		self._start_smp()
+
+	def _start_smp(self):
+		if self.smp:
+			self.smp.close()
+			self.smp = None
+
+		# Imported here: multiprocessing is a noticeable part of startup and
+		# a single core engine never needs it
+		if self.cores > 1:
+			from smp import LazySMP
+			self.smp = LazySMP(self.tt, self.cores)
+
+	# A missing or unreadable book just means we search from the first move
+	def set_book(self, path):
+		if self.book:
+			self.book.close()
+			self.book = None
 
+		try:
+			self.book = PolyglotBook(path)
+			logger.info('book %s: %d entries' % (path, self.book.entries))
+		except OSError as error:
+			logger.warning('no opening book: %s' % error)
+
+	def close(self):
+		self.abort()
+		if self.stats_file:
+			self.stats_file.close()
+		if self.profiler:
+			self.profiler.dump_stats(self.profile_path)
+		if self.book:
+			self.book.close()
+		if self.smp:
+			self.smp.close()
+		self.tt.close(unlink=True)
+
+	# Moves are generated for the side on move, so go just plays whoever that is
 	def go(self):
-		if(self.first_move_made):
-			self.think()
-		else:
-			self.position = Bitboard('white')
-			self.think()
+		self.forced = False
+		self.think()
 
-	def move(self, move):
-		self.position.make_move(move)
-		formatted = self.position.as_algebraic_coords(move)
-		self.output.send('move ' + formatted)
+	# force: stop thinking and just track the moves we are sent
+	def force(self):
+		self.abort()
+		self.forced = True
+
+	# post and nopost
+	def set_post(self, post):
+		self.post = post
+
+	# hard and easy turn pondering on and off
+	def set_ponder(self, ponder):
+		self.ponder = ponder
+		if not ponder and self.pondering:
+			self.abort()
+
+	# ?: play the best move found so far. Meaningless while pondering, it
+	# isn't our move. Returns once the move is out.
+	def move_now(self):
+		if not self.pondering:
+			self.stop.set()
+			self.moved.wait()
+
+	# Returns once we are not thinking about a move of our own, pondering
+	# doesn't count. ping is answered after this: pong must follow the move.
+	def wait_for_move(self):
+		self.moved.wait()
+
+	# result and quit: the game is over, whatever we were thinking about is moot
+	def result(self):
+		self.abort()
+		self.forced = True
+
+	# Ends the running search without playing its move
+	def abort(self):
+		if self.thread:
+			self.discard = True
+			self.stop.set()
+			self.ponder_over.set()
+			self.wait()
+		self.pondering = False
+
+	def wait(self):
+		if self.thread:
+			self.thread.join()
+			self.thread = None
 
 	def user_move(self, move_notation):
+		if self.pondering:
+			# The ponder search works on its own copy, the game position is ours to read
+			move = self.position.create_move_from_algebraic_coords(move_notation)
+			if move is not None and move == self.ponder_move:
+				self._ponder_hit(move)
+				return
+
+			logger.debug('ponder miss')
+
+		self.abort()
 		move = self.position.create_move_from_algebraic_coords(move_notation)
+		if move is None:
+			self.output.send('Illegal move: ' + move_notation)
+			return
+
 		self.position.make_move(move)
-		self.think()
+		if not self.forced:
+			self.think()
 
+	# Starts searching for our move and returns straight away
 	def think(self):
-		# Random legal move in the position
-		moves = self.position.moves()
+		self.abort()
+		if self.book:
+			move = self.book.choose(self.position)
+			if move:
+				self._play(move)
+				return
+
+		soft_limit, hard_limit = self.clock.allocate(self.moves_made)
+		self._start(Search(self.position, self.tt, soft_limit, hard_limit, self.clock.max_depth, self.stop, post=self._post, pawns=self.pawns))
+
+	def _start(self, search):
+		self.stop.clear()
+		self.discard = False
+		self.moved.clear()
+		self.thread = threading.Thread(target=self._think, args=(search,), name='search', daemon=True)
+		self.thread.start()
 
-		if(len(moves)):
-			self.move(random.choice(moves))
-		else:
-			self.output.send('resign')
+	# Runs on the search thread. After our move it keeps going with a ponder
+	# search, if there is one, until that turns out to be a miss.
+	def _think(self, search):
+		# cProfile only sees the thread it is enabled on
+		if self.profiler:
+			self.profiler.enable()
+		try:
+			while search:
+				move = self.smp.run(search) if self.smp else search.run()
+				if search is self.ponder_search:
+					# Finished before the opponent moved, hold the move until we know
+					self.ponder_over.wait()
+					self.ponder_search = None
+
+				next_search = None
+				if not self.discard:
+					if move:
+						next_search = self._play(move, search)
+					else:
+						self.output.send('resign')
+						self.moved.set()
+
+				# The move goes out before waiting for the helpers to stop
+				if self.smp:
+					self.smp.finish(search)
+				self._record(search)
+				search = next_search
+		except:
+			logger.exception('search failed')
+		finally:
+			if self.profiler:
+				self.profiler.disable()
+			self.moved.set()
+
+	# Thinking output for each completed iteration: ply, score, time in
+	# centiseconds, nodes and the principal variation
+	def _post(self, iteration):
+		if self.post:
+			self.output.send('%d %d %d %d %s' % (
+				iteration.depth, _xboard_score(iteration.score), int(iteration.time * 100), iteration.nodes,
+				' '.join(self.position.algebraic_coords(iteration.pv))
+			))
+
+	# The counters of a finished search, kept as the last record and logged
+	def _record(self, search):
+		self.record = search.record()
+		line = json.dumps(self.record)
+		logger.debug('search: ' + line)
+		if self.stats_file:
+			self.stats_file.write(line + '\n')
+			self.stats_file.flush()
+
+	# Plays our move and sets up the ponder search on the reply we expect.
+	# The ponder position is copied before the move goes out, so the main
+	# thread can't be handed the opponent's reply while we still read the board.
+	def _play(self, move, search=None):
+		pv = search.principal_variation(2) if search else []
+		self.position.make_move(move)
+		self.moves_made += 1
+
+		ponder_search = None
+		if self.ponder and not self.forced and len(pv) > 1:
+			ponder_search = Search(self.position, self.tt, None, None, self.clock.max_depth, self.stop, post=self._post, pawns=self.pawns)
+			ponder_search.position.make_move(pv[1])
+			self.ponder_move = pv[1]
+			self.ponder_search = ponder_search
+			self.ponder_over.clear()
+			self.pondering = True
+			logger.debug('pondering on ' + self.position.as_algebraic_coords(pv[1]))
+
+		self.output.send('move ' + self.position.as_algebraic_coords(move))
+		self.moved.set()
+		return ponder_search
+
+	# Keep the ponder search, now on our clock
+	def _ponder_hit(self, move):
+		logger.debug('ponder hit')
+		self.position.make_move(move)
+		self.pondering = False
+		self.moved.clear()
+		soft_limit, hard_limit = self.clock.allocate(self.moves_made)
+		self.ponder_search.ponder_hit(soft_limit, hard_limit)
+		self.ponder_over.set()
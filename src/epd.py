@@ -0,0 +1,122 @@
+from bitboard import Bitboard, FenError
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from search import Search
+from tt import TranspositionTable
+import argparse, os, re, sys, time
+
+# One EPD line: the four FEN position fields and the operations after them,
+# {opcode: [operands]}. bm and am operands are SAN moves.
+EpdRecord = namedtuple('EpdRecord', ['fen', 'operations'])
+
+EpdResult = namedtuple('EpdResult', ['id', 'move', 'solved', 'nodes', 'elapsed'])
+
+# Operations end at semicolons, except inside a quoted operand
+def _split_operations(text):
+	parts = ['']
+	quoted = False
+	for char in text:
+		if char == '"':
+			quoted = not quoted
+		if char == ';' and not quoted:
+			parts.append('')
+		else:
+			parts[-1] += char
+
+	return parts
+
+# An operand is a double quoted string or a run of non-blank characters.
+# Not shlex: apostrophes in id and c0 strings are just text.
+OPERAND = re.compile(r'"([^"]*)"?|(\S+)')
+
+def _split_operands(operation):
+	return [match.group(1) if match.group(2) is None else match.group(2) for match in OPERAND.finditer(operation)]
+
+def parse_epd(line):
+	fields = line.split(None, 4)
+	if len(fields) < 4:
+		return None
+
+	operations = {}
+	for operation in _split_operations(fields[4] if len(fields) > 4 else ''):
+		words = _split_operands(operation)
+		if words:
+			operations[words[0]] = words[1:]
+
+	return EpdRecord(' '.join(fields[:4]), operations)
+
+# Lines whose position can't be read are reported and skipped, one bad
+# line doesn't stop a whole suite
+def read_epd(path):
+	records = []
+	with open(path) as epd_file:
+		for number, line in enumerate(epd_file, 1):
+			record = parse_epd(line)
+			if not record:
+				continue
+			try:
+				Bitboard.from_fen(record.fen)
+			except FenError as error:
+				print('%s:%d: skipped, %s' % (path, number, error), file=sys.stderr)
+				continue
+			records.append(record)
+
+	return records
+
+# Runs in a pool worker: searches one position with a fresh table, so
+# results don't depend on which positions a worker saw before
+def _solve(record, seconds, nodes, max_depth, hash_mb):
+	position = Bitboard.from_fen(record.fen)
+	tt = TranspositionTable(hash_mb)
+	search = Search(position, tt, seconds, seconds, max_depth, node_limit=nodes)
+	start = time.monotonic()
+	move = search.run()
+	elapsed = time.monotonic() - start
+
+	san = position.as_san(move) if move else None
+	best = [position.create_move_from_san(notation) for notation in record.operations.get('bm', [])]
+	avoid = [position.create_move_from_san(notation) for notation in record.operations.get('am', [])]
+	solved = move is not None and (not best or move in best) and move not in avoid
+
+	name = ' '.join(record.operations.get('id', [])) or record.fen
+	tt.close()
+	return EpdResult(name, san, solved, search.nodes, elapsed)
+
+# Every position goes to its own task, so a slow one doesn't hold back a
+# whole chunk. Results come back in suite order.
+def run_suite(records, seconds=None, nodes=None, max_depth=None, hash_mb=4, workers=None):
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		tasks = [pool.submit(_solve, record, seconds, nodes, max_depth, hash_mb) for record in records]
+		for task in tasks:
+			yield task.result()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Runs bm/am EPD test suites such as WAC or STS')
+	parser.add_argument('epd', help='EPD file')
+	parser.add_argument('-t', '--time', type=float, help='seconds per position')
+	parser.add_argument('-n', '--nodes', type=int, help='nodes per position')
+	parser.add_argument('-d', '--depth', type=int, help='maximum depth per position')
+	parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='positions searched at once')
+	parser.add_argument('--hash', dest='hash_mb', type=int, default=4, help='table size per worker in MB')
+	args = parser.parse_args()
+
+	if args.time is None and args.nodes is None and args.depth is None:
+		args.time = 1.0
+
+	records = read_epd(args.epd)
+	solved = 0
+	total_nodes = 0
+	search_time = 0.0
+	start = time.monotonic()
+	for result in run_suite(records, args.time, args.nodes, args.depth, args.hash_mb, args.workers):
+		solved += result.solved
+		total_nodes += result.nodes
+		search_time += result.elapsed
+		print('%-24s %-8s %-6s %10d nodes  %6.2fs' % (result.id, result.move or '-', 'ok' if result.solved else 'miss', result.nodes, result.elapsed))
+
+	elapsed = time.monotonic() - start
+	if records:
+		print('solved %d/%d (%.1f%%), %d nodes in %.2fs, %.0f nps per worker, %.0f nps total' % (
+			solved, len(records), 100.0 * solved / len(records), total_nodes, elapsed,
+			total_nodes / search_time if search_time else 0, total_nodes / elapsed if elapsed else 0
+		))
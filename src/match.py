@@ -0,0 +1,348 @@
+from bitboard import Bitboard, PIECE_BASE, START_FEN, WHITE, BLACK
+from bitops import popcount
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from engine import Engine
+from move import PAWN, KNIGHT, BISHOP, ROOK, QUEEN
+import argparse, math, os, queue, time
+
+# Headless self-play: two engine configurations play each other, one game
+# per pool task, with the engines driven in-process instead of over XBoard.
+# Each opening is played twice with colors reversed. Results stream into an
+# SPRT that can end the match as soon as it decides.
+
+# name and the Engine settings that tell two players apart: table size,
+# opening book, depth limit and time control ((base, increment) seconds,
+# None for the match default)
+EngineConfig = namedtuple('EngineConfig', ['name', 'hash_mb', 'book', 'depth', 'tc'])
+
+# termination is one of the PGN Termination tag values, reason says what
+# happened in words
+GameResult = namedtuple('GameResult', ['index', 'white', 'black', 'result', 'termination', 'reason', 'plies', 'pgn'])
+
+# Games stop being played out here and count as drawn
+DEFAULT_MAX_PLIES = 400
+
+# Seconds a move may run over the clock before it counts as a loss on time
+DEFAULT_TIME_MARGIN = 0.1
+
+# BASE+INC in seconds, like 10+0.1
+def parse_tc(text):
+	base, _, increment = text.partition('+')
+	return float(base), float(increment or 0)
+
+# NAME:key=value,... with the keys hash, book, depth and tc, e.g.
+# "small:hash=4,depth=5". Without a name the whole spec names the engine.
+def parse_config(spec):
+	name, _, options = spec.partition(':')
+	settings = dict(option.split('=', 1) for option in options.split(',') if option)
+	for key in settings:
+		if key not in ('hash', 'book', 'depth', 'tc'):
+			raise ValueError('unknown engine option %s in %s' % (key, spec))
+
+	return EngineConfig(
+		name or spec,
+		int(settings.get('hash', 16)),
+		settings.get('book'),
+		int(settings['depth']) if 'depth' in settings else None,
+		parse_tc(settings['tc']) if 'tc' in settings else None
+	)
+
+# One FEN or EPD position per line, blank lines and # comments skipped
+def read_openings(path):
+	openings = []
+	with open(path) as opening_file:
+		for line in opening_file:
+			fields = line.split(';')[0].split()
+			if not fields or fields[0].startswith('#'):
+				continue
+			# Keep the move counters of a full FEN, EPD has none
+			counters = len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit()
+			openings.append(' '.join(fields[:6] if counters else fields[:4]))
+
+	return openings
+
+# Stands in for XBoard: collects what the engine sends for the game loop
+class _Output:
+	def __init__(self):
+		self.lines = queue.Queue()
+
+	def send(self, data):
+		self.lines.put(data)
+
+def _start_engine(config, tc, fen):
+	engine = Engine(config.hash_mb, 1, config.book)
+	output = _Output()
+	engine.set_output(output)
+	engine.new()
+	if fen != START_FEN:
+		engine.set_board(fen)
+	engine.force()
+
+	base, increment = config.tc or tc
+	engine.clock.level(0, '0:%g' % base, increment)
+	if config.depth:
+		engine.clock.set_max_depth(config.depth)
+
+	return engine, output
+
+# Threefold repetition counts the current position too
+def _repetitions(position):
+	key = position.hash()
+	count = 1
+	for undo in reversed(position.history):
+		if undo.hash == key:
+			count += 1
+		if (undo.move >> 15) & 7 or (undo.move >> 12) & 7 == PAWN:
+			break
+
+	return count
+
+# Bare kings, or a single minor piece left on the board
+def _insufficient_material(position):
+	minors = 0
+	pieces = position.pieces
+	for base in PIECE_BASE:
+		if pieces[base + PAWN] or pieces[base + ROOK] or pieces[base + QUEEN]:
+			return False
+		minors += popcount(pieces[base + KNIGHT] | pieces[base + BISHOP])
+
+	return minors <= 1
+
+# (result, termination, reason) once the game is over, None while it goes on
+def _game_over(position, max_plies):
+	if not position.moves():
+		if position.in_check():
+			return ('0-1' if position.turn == WHITE else '1-0'), 'normal', 'checkmate'
+		return '1/2-1/2', 'normal', 'stalemate'
+	if position.halfmove >= 100:
+		return '1/2-1/2', 'normal', 'fifty move rule'
+	if _repetitions(position) >= 3:
+		return '1/2-1/2', 'normal', 'threefold repetition'
+	if _insufficient_material(position):
+		return '1/2-1/2', 'normal', 'insufficient material'
+	if len(position.history) >= max_plies:
+		return '1/2-1/2', 'adjudication', 'draw after %d plies' % max_plies
+
+	return None
+
+def _pgn(index, fen, white, black, tc, result, termination, reason, sans, first_move, black_first):
+	headers = [
+		('Event', 'derpfish match'),
+		('Site', os.uname().nodename if hasattr(os, 'uname') else '?'),
+		('Date', time.strftime('%Y.%m.%d')),
+		('Round', str(index + 1)),
+		('White', white),
+		('Black', black),
+		('Result', result)
+	]
+	if fen != START_FEN:
+		headers += [('SetUp', '1'), ('FEN', fen)]
+	headers += [('TimeControl', '%g+%g' % tc), ('PlyCount', str(len(sans))), ('Termination', termination)]
+
+	tokens = []
+	move_number = first_move
+	for ply, san in enumerate(sans):
+		black_to_move = (ply % 2 == 1) != black_first
+		if not black_to_move:
+			tokens.append('%d.' % move_number)
+		elif ply == 0:
+			tokens.append('%d...' % move_number)
+		tokens.append(san)
+		if black_to_move:
+			move_number += 1
+	tokens += ['{%s}' % reason, result]
+
+	lines = ['']
+	for token in tokens:
+		if lines[-1] and len(lines[-1]) + 1 + len(token) > 79:
+			lines.append('')
+		lines[-1] += (' ' if lines[-1] else '') + token
+
+	return '\n'.join(['[%s "%s"]' % header for header in headers] + [''] + lines) + '\n'
+
+# Runs in a pool worker: plays one game between fresh engines. Clocks are
+# kept here, on wall time, and every engine is told both before it moves.
+def play_game(index, fen, white, black, tc, max_plies=DEFAULT_MAX_PLIES, margin=DEFAULT_TIME_MARGIN):
+	players = [_start_engine(white, tc, fen), _start_engine(black, tc, fen)]
+	configs = [white, black]
+	clocks = [(config.tc or tc)[0] for config in configs]
+	position = Bitboard(fen)
+	first_move = position.fullmove
+	black_first = position.turn == BLACK
+	sans = []
+
+	try:
+		while True:
+			over = _game_over(position, max_plies)
+			if over:
+				result, termination, reason = over
+				break
+
+			side = position.turn
+			engine, output = players[side]
+			engine.clock.set_remaining(int(clocks[side] * 100))
+			engine.clock.set_opponent_remaining(int(clocks[side ^ 1] * 100))
+
+			start = time.monotonic()
+			engine.go()
+			try:
+				reply = output.lines.get(timeout=clocks[side] + margin)
+			except queue.Empty:
+				reply = None
+			clocks[side] -= time.monotonic() - start
+			engine.force()
+
+			if clocks[side] < -margin or not reply:
+				result, termination, reason = ('0-1' if side == WHITE else '1-0'), 'time forfeit', '%s loses on time' % configs[side].name
+				break
+
+			move = position.create_move_from_algebraic_coords(reply.split()[-1]) if reply.startswith('move ') else None
+			if move is None:
+				result, termination, reason = ('0-1' if side == WHITE else '1-0'), 'rules infraction', '%s sent %s' % (configs[side].name, reply)
+				break
+
+			clocks[side] += (configs[side].tc or tc)[1]
+			sans.append(position.as_san(move))
+			position.make_move(move)
+			players[side ^ 1][0].user_move(reply.split()[-1])
+	finally:
+		for engine, output in players:
+			engine.close()
+
+	pgn = _pgn(index, fen, white.name, black.name, tc, result, termination, reason, sans, first_move, black_first)
+	return GameResult(index, white.name, black.name, result, termination, reason, len(sans), pgn)
+
+# Logistic Elo difference of a score fraction
+def _elo(score):
+	score = min(max(score, 1e-6), 1 - 1e-6)
+	return -400 * math.log10(1 / score - 1)
+
+# (Elo, 95% error margin) of a win/draw/loss record
+def elo_estimate(wins, draws, losses):
+	games = wins + draws + losses
+	if not games:
+		return 0.0, None
+	score = (wins + draws / 2) / games
+	variance = (wins * (1 - score)**2 + draws * (0.5 - score)**2 + losses * score**2) / games
+	error = 1.96 * math.sqrt(variance / games)
+	return _elo(score), (_elo(score + error) - _elo(score - error)) / 2
+
+# Sequential probability ratio test of elo1 against elo0, on the normal
+# approximation of the mean game score: the generalized SPRT used by
+# fishtest for win/draw/loss results. 'H1' accepts the change, 'H0'
+# rejects it, None means keep playing.
+class SPRT:
+	def __init__(self, elo0, elo1, alpha=0.05, beta=0.05):
+		self.elo0 = elo0
+		self.elo1 = elo1
+		self.lower = math.log(beta / (1 - alpha))
+		self.upper = math.log((1 - beta) / alpha)
+
+	def llr(self, wins, draws, losses):
+		games = wins + draws + losses
+		if not games:
+			return 0.0
+		# An outcome that hasn't happened yet would make the variance collapse
+		# (all wins has none at all), count half a game of each instead
+		if not (wins and draws and losses):
+			wins, draws, losses = wins + 0.5, draws + 0.5, losses + 0.5
+			games += 1.5
+		score = (wins + draws / 2) / games
+		variance = (wins * (1 - score)**2 + draws * (0.5 - score)**2 + losses * score**2) / games
+		if variance <= 0:
+			return 0.0
+
+		score0 = 1 / (1 + 10**(-self.elo0 / 400))
+		score1 = 1 / (1 + 10**(-self.elo1 / 400))
+		return games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+
+	def status(self, wins, draws, losses):
+		llr = self.llr(wins, draws, losses)
+		if llr >= self.upper:
+			return 'H1'
+		if llr <= self.lower:
+			return 'H0'
+		return None
+
+# Plays up to games games, the first engine taking white in the even ones,
+# and yields (GameResult, wins, draws, losses) from the first engine's side
+# as games finish. With an sprt the match stops once it decides: games not
+# yet started are cancelled, the ones being played are waited for.
+def run_match(first, second, openings, games, tc, workers=None, max_plies=DEFAULT_MAX_PLIES, margin=DEFAULT_TIME_MARGIN, sprt=None):
+	wins = draws = losses = 0
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		tasks = []
+		for index in range(games):
+			fen = openings[(index // 2) % len(openings)]
+			white, black = (first, second) if index % 2 == 0 else (second, first)
+			tasks.append(pool.submit(play_game, index, fen, white, black, tc, max_plies, margin))
+
+		decided = False
+		for task in as_completed(tasks):
+			if task.cancelled():
+				continue
+			game = task.result()
+			if game.result == '1/2-1/2':
+				draws += 1
+			elif (game.result == '1-0') == (game.white == first.name):
+				wins += 1
+			else:
+				losses += 1
+
+			yield game, wins, draws, losses
+			if sprt and not decided and sprt.status(wins, draws, losses):
+				decided = True
+				for pending in tasks:
+					pending.cancel()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Plays two engine configurations against each other')
+	parser.add_argument('first', type=parse_config, help='NAME:hash=MB,book=FILE,depth=N,tc=BASE+INC, all optional')
+	parser.add_argument('second', type=parse_config)
+	parser.add_argument('-o', '--openings', help='FEN or EPD file, each position is played with both colors')
+	parser.add_argument('-n', '--games', type=int, help='games to play, by default each opening twice')
+	parser.add_argument('--tc', type=parse_tc, default=(10.0, 0.1), help='BASE+INC seconds, default 10+0.1')
+	parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='games played at once')
+	parser.add_argument('--pgn', help='append the games to this PGN file')
+	parser.add_argument('--sprt', nargs=2, type=float, metavar=('ELO0', 'ELO1'), help='stop once an SPRT of ELO1 against ELO0 decides')
+	parser.add_argument('--alpha', type=float, default=0.05)
+	parser.add_argument('--beta', type=float, default=0.05)
+	parser.add_argument('--max-plies', type=int, default=DEFAULT_MAX_PLIES, help='adjudicate a draw after this many plies')
+	parser.add_argument('--margin', type=float, default=DEFAULT_TIME_MARGIN, help='seconds a move may overrun the clock')
+	args = parser.parse_args()
+
+	if args.first.name == args.second.name:
+		args.second = args.second._replace(name=args.second.name + '-2')
+
+	openings = read_openings(args.openings) if args.openings else [START_FEN]
+	games = args.games or 2 * len(openings)
+	sprt = SPRT(args.sprt[0], args.sprt[1], args.alpha, args.beta) if args.sprt else None
+	pgn_file = open(args.pgn, 'a') if args.pgn else None
+
+	start = time.monotonic()
+	wins = draws = losses = 0
+	try:
+		for game, wins, draws, losses in run_match(args.first, args.second, openings, games, args.tc, args.workers, args.max_plies, args.margin, sprt):
+			if pgn_file:
+				pgn_file.write(game.pgn + '\n')
+				pgn_file.flush()
+
+			elo, margin = elo_estimate(wins, draws, losses)
+			line = 'game %4d  %s - %s  %-7s %-28s  %d-%d-%d  elo %+.1f' % (
+				game.index + 1, game.white, game.black, game.result, game.reason, wins, losses, draws, elo
+			)
+			if margin is not None:
+				line += ' +/- %.1f' % margin
+			if sprt:
+				line += '  llr %.2f (%.2f, %.2f)' % (sprt.llr(wins, draws, losses), sprt.lower, sprt.upper)
+			print(line, flush=True)
+	finally:
+		if pgn_file:
+			pgn_file.close()
+
+	played = wins + draws + losses
+	print('%s vs %s: %d games in %.0fs, +%d -%d =%d' % (args.first.name, args.second.name, played, time.monotonic() - start, wins, losses, draws))
+	if sprt:
+		status = sprt.status(wins, draws, losses)
+		print('SPRT elo0=%g elo1=%g: %s' % (sprt.elo0, sprt.elo1, {'H1': 'H1 accepted', 'H0': 'H0 accepted', None: 'undecided'}[status]))
@@ -0,0 +1,43 @@
+from array import array
+
+# Moves are packed into ints so the generator can write them straight into
+# preallocated array('I') buffers:
+#   bits  0-5   from square
+#   bits  6-11  to square
+#   bits 12-14  moving piece, an index into MOVE_PIECES
+#   bits 15-17  captured piece, 0 for none
+#   bits 18-20  promotion piece, 0 for none
+#   bits 21-22  special move flag
+#   bits 24-31  ordering score, ignored by everything but move ordering
+
+MOVE_PIECES = [None, 'pawn', 'knight', 'bishop', 'rook', 'king', 'queen']
+PIECE_CODES = dict((piece_name, code) for code, piece_name in enumerate(MOVE_PIECES) if piece_name)
+
+PAWN = PIECE_CODES['pawn']
+KNIGHT = PIECE_CODES['knight']
+BISHOP = PIECE_CODES['bishop']
+ROOK = PIECE_CODES['rook']
+KING = PIECE_CODES['king']
+QUEEN = PIECE_CODES['queen']
+
+FLAG_NONE = 0
+FLAG_EN_PASSANT = 1
+FLAG_CASTLING = 2
+FLAG_DOUBLE_PUSH = 3
+
+# The move without its ordering score
+MOVE_MASK = 0xFFFFFF
+
+# More than the most moves possible in any position (218)
+MAX_MOVES = 256
+
+def encode_move(from_sq, to_sq, piece, capture=0, promotion=0, flag=FLAG_NONE):
+	return from_sq | to_sq<<6 | piece<<12 | capture<<15 | promotion<<18 | flag<<21
+
+# Name of the captured piece, None for a quiet move
+def move_capture(move):
+	return MOVE_PIECES[(move >> 15) & 7]
+
+# A reusable buffer for one ply of generated moves
+def move_buffer():
+	return array('I', bytes(array('I').itemsize * MAX_MOVES))
@@ -0,0 +1,112 @@
+from move import MOVE_MASK
+
+# MVV-LVA ranks, indexed by piece code (see MOVE_PIECES). Kings are never
+# captured, as attackers they rank last.
+VICTIM_RANKS = [0, 1, 2, 3, 4, 0, 5]
+ATTACKER_RANKS = [0, 1, 2, 3, 4, 6, 5]
+
+# History scores are halved once one passes this, so old results fade and
+# the scores stay small ints
+HISTORY_LIMIT = 1<<20
+
+# Ordering score of a capture or promotion: most valuable victim first,
+# least valuable attacker first among equal victims. A promotion counts as
+# capturing the piece it promotes to. Fits the 8 bit score field.
+def mvv_lva(move):
+	return (VICTIM_RANKS[(move >> 15) & 7] + VICTIM_RANKS[(move >> 18) & 7]) * 8 + 7 - ATTACKER_RANKS[(move >> 12) & 7]
+
+# No capture and no promotion
+def _is_quiet(move):
+	return not (move >> 15) & 63
+
+# From and to square, the index into the butterfly tables
+def _butterfly(move):
+	return move & 4095
+
+# What the search has learned about quiet moves. Killers are the last two
+# quiet moves that caused a cutoff at a ply, history scores every from/to
+# pair by the cutoffs it caused, and the countermove table remembers the
+# quiet move that refuted each previous move.
+class MoveOrdering:
+	def __init__(self, plies):
+		self.killers = [[0, 0] for ply in range(plies)]
+		self.history = [0] * 4096
+		self.countermoves = [0] * 4096
+
+	def _previous(self, position):
+		history = position.history
+		return history[-1].move if history else 0
+
+	# move caused a beta cutoff at ply with depth left to search
+	def cutoff(self, position, move, ply, depth):
+		if not _is_quiet(move):
+			return
+
+		killers = self.killers[ply]
+		if killers[0] != move:
+			killers[1] = killers[0]
+			killers[0] = move
+
+		index = _butterfly(move)
+		self.history[index] += depth * depth
+		if self.history[index] > HISTORY_LIMIT:
+			self.history = [score // 2 for score in self.history]
+
+		previous = self._previous(position)
+		if previous:
+			self.countermoves[_butterfly(previous)] = move
+
+	# The killers, then the countermove, that are legal here
+	def refutations(self, position, ply):
+		moves = []
+		for move in self.killers[ply] + [self.countermoves[_butterfly(self._previous(position))]]:
+			if move and move not in moves and position.is_legal(move):
+				moves.append(move)
+
+		return moves
+
+# The captures and promotions of a position, best MVV-LVA score first. The
+# score goes in the top bits, so the moves sort by it.
+def ordered_captures(position, buffer):
+	count = position.generate_captures(buffer)
+	for index in range(count):
+		buffer[index] |= mvv_lva(buffer[index])<<24
+
+	return [move & MOVE_MASK for move in sorted(buffer[0:count], reverse=True)]
+
+# Yields the legal moves of a position lazily, in stages: the hash move,
+# captures and promotions by MVV-LVA, killers and the countermove, then
+# the other quiet moves by history score. Each stage is only generated
+# once the previous one is used up, so a node that cuts off on the hash
+# move or a capture never pays for the rest. buffer must not be shared
+# with a picker that is still live, search keeps one per ply. Without
+# ordering, quiet moves come in generation order.
+def staged_moves(position, buffer, hash_move=0, ordering=None, ply=0):
+	hash_move &= MOVE_MASK
+	if hash_move and position.is_legal(hash_move):
+		yield hash_move
+	else:
+		hash_move = 0
+
+	captures = ordered_captures(position, buffer)
+	for move in captures:
+		if move != hash_move:
+			yield move
+
+	played = [hash_move]
+	if ordering:
+		for move in ordering.refutations(position, ply):
+			if move != hash_move:
+				played.append(move)
+				yield move
+
+	# Quiets go after the captures so the two stages never overlap in the buffer
+	count = len(captures)
+	end = position.generate_quiets(buffer, count)
+	quiets = buffer[count:end]
+	if ordering:
+		history = ordering.history
+		quiets = sorted(quiets, key=lambda move: history[_butterfly(move)], reverse=True)
+	for move in quiets:
+		if move not in played:
+			yield move
@@ -0,0 +1,161 @@
+from array import array
+from bitops import MASK_64, board, popcount
+
+# Pawn structure: doubled, isolated, backward and passed pawns, scored with
+# whole-board fills rather than pawn by pawn. The terms only depend on where
+# the pawns stand, and pawns move far less often than pieces, so PawnTable
+# caches them by a Zobrist key of the pawns alone. Scores are (midgame,
+# endgame) pairs, positive for white, tapered with the rest of the eval.
+
+# Per pawn with an own pawn in front of it on the same file
+DOUBLED = (-10, -25)
+# Per pawn with no own pawns on the neighbouring files
+ISOLATED = (-12, -15)
+# Per pawn that no neighbour can come up to defend, whose stop square an
+# enemy pawn attacks
+BACKWARD = (-8, -10)
+
+# Passed pawn bonuses by rank, counted from the pawn's own side
+PASSED_MG = [0, 5, 10, 15, 30, 55, 90, 0]
+PASSED_EG = [0, 10, 15, 25, 45, 75, 120, 0]
+
+# The terms below also depend on where the pieces stand, so they are not
+# cached: evaluate adds them per position on top of the structure score
+
+# Per passed pawn with an enemy piece on its stop square
+PASSED_BLOCKED = (-5, -20)
+# Midgame bonus per own pawn one and two ranks in front of the king, on its
+# file or a neighbouring one
+SHIELD_NEAR = 12
+SHIELD_FAR = 6
+
+FILE_A = board(0x8080808080808080)
+FILE_H = board(0x0101010101010101)
+RANKS = [board(0xFF)<<(8 * rank) for rank in range(8)]
+
+# Directions as seen from white, bit 0 = h1 and bit 63 = a8
+def _north(bb):
+	return (bb<<8) & MASK_64
+
+def _south(bb):
+	return bb>>8
+
+def _east(bb):
+	return (bb & ~FILE_H)>>1
+
+def _west(bb):
+	return (bb & ~FILE_A)<<1
+
+def _north_fill(bb):
+	bb |= bb<<8
+	bb |= bb<<16
+	bb |= bb<<32
+	return bb & MASK_64
+
+def _south_fill(bb):
+	bb |= bb>>8
+	bb |= bb>>16
+	bb |= bb>>32
+	return bb
+
+def _spread(bb):
+	return bb | _east(bb) | _west(bb)
+
+# Mirrors the board top to bottom: rank 8 becomes rank 1. Black's terms are
+# white's terms on the mirrored board.
+def flip(bb):
+	return board(int.from_bytes(int(bb).to_bytes(8, 'little'), 'big'))
+
+# The terms for the side moving north, and its passed pawns
+def _white_terms(own, enemy):
+	doubled = own & _south_fill(_south(own))
+	files = _north_fill(own) | _south_fill(own)
+	isolated = own & ~(_east(files) | _west(files))
+
+	# Squares enemy pawns still have to cross, and the files beside them
+	enemy_span = _spread(_south_fill(_south(enemy)))
+	passed = own & ~enemy_span & ~doubled
+
+	enemy_attacks = _south(_east(enemy) | _west(enemy))
+	support = _north_fill(_east(own) | _west(own))
+	backward = own & ~support & ~isolated & _south(enemy_attacks)
+
+	mg = DOUBLED[0] * popcount(doubled) + ISOLATED[0] * popcount(isolated) + BACKWARD[0] * popcount(backward)
+	eg = DOUBLED[1] * popcount(doubled) + ISOLATED[1] * popcount(isolated) + BACKWARD[1] * popcount(backward)
+	if passed:
+		for rank in range(1, 7):
+			count = popcount(passed & RANKS[rank])
+			mg += PASSED_MG[rank] * count
+			eg += PASSED_EG[rank] * count
+
+	return mg, eg, passed
+
+# SHIELDS[color][king square] is the pair of near and far shield masks
+def _build_shields():
+	white = []
+	for sq in range(64):
+		near = _spread(_north(board(1)<<sq))
+		white.append((near, _north(near)))
+
+	# sq ^ 56 is the square on the mirrored board
+	black = [(flip(white[sq ^ 56][0]), flip(white[sq ^ 56][1])) for sq in range(64)]
+	return [white, black]
+
+SHIELDS = _build_shields()
+
+# Midgame shield score, white-relative, for kings on the given squares
+def shield(white_pawns, black_pawns, white_king, black_king):
+	near, far = SHIELDS[0][white_king]
+	score = SHIELD_NEAR * popcount(near & white_pawns) + SHIELD_FAR * popcount(far & white_pawns)
+	near, far = SHIELDS[1][black_king]
+	return score - SHIELD_NEAR * popcount(near & black_pawns) - SHIELD_FAR * popcount(far & black_pawns)
+
+# Structure score and passed pawns of one pawn structure: (midgame,
+# endgame, white passers, black passers), scores white-relative
+def pawn_structure(white_pawns, black_pawns):
+	white_mg, white_eg, passed_white = _white_terms(white_pawns, black_pawns)
+	black_mg, black_eg, passed_black = _white_terms(flip(black_pawns), flip(white_pawns))
+	return white_mg - black_mg, white_eg - black_eg, passed_white, flip(passed_black)
+
+# Penalty pair for passed pawns whose stop square holds an enemy piece
+def blocked(passed_white, passed_black, white_pieces, black_pieces):
+	if not (passed_white or passed_black):
+		return 0, 0
+
+	count = popcount(_north(passed_white) & black_pieces) - popcount(_south(passed_black) & white_pieces)
+	return PASSED_BLOCKED[0] * count, PASSED_BLOCKED[1] * count
+
+DEFAULT_ENTRIES = 1<<14
+
+# A fixed number of slots indexed by the low bits of the pawn key, laid out
+# in flat arrays like the transposition table, so probing allocates no
+# entry objects. A probe that misses computes the structure and replaces
+# whatever the slot held. Slots start zeroed, which is also the right entry
+# for key 0: no pawns, no score. entries must be a power of two.
+class PawnTable:
+	def __init__(self, entries=DEFAULT_ENTRIES):
+		self.entries = entries
+		self.mask = entries - 1
+		self.clear()
+
+	def clear(self):
+		self.keys = array('Q', bytes(8 * self.entries))
+		self.mg = array('i', bytes(4 * self.entries))
+		self.eg = array('i', bytes(4 * self.entries))
+		self.passed_white = array('Q', bytes(8 * self.entries))
+		self.passed_black = array('Q', bytes(8 * self.entries))
+		self.probes = 0
+		self.hits = 0
+
+	# pawn_structure() for the pawns with the given key
+	def probe(self, key, white_pawns, black_pawns):
+		index = key & self.mask
+		self.probes += 1
+		if self.keys[index] == key:
+			self.hits += 1
+			return self.mg[index], self.eg[index], self.passed_white[index], self.passed_black[index]
+
+		structure = pawn_structure(white_pawns, black_pawns)
+		self.keys[index] = key
+		self.mg[index], self.eg[index], self.passed_white[index], self.passed_black[index] = structure
+		return structure
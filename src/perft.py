@@ -0,0 +1,208 @@
+from bitboard import Bitboard, START_FEN
+from bitops import BACKEND, BACKENDS
+from move import move_buffer
+import argparse, importlib.util, os, subprocess, sys, time
+
+# (name, FEN, {depth: leaf nodes}). The first six are the standard
+# chessprogramming.org positions, the rest each exercise one rule that is
+# easy to get wrong (en passant, castling, promotion, discovered checks).
+PERFT_POSITIONS = [
+	('start', START_FEN,
+		{1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+	('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+		{1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+	('position-3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+		{1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+	('position-4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+		{1: 6, 2: 264, 3: 9467, 4: 422333}),
+	('position-4-mirrored', 'r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1',
+		{1: 6, 2: 264, 3: 9467, 4: 422333}),
+	('position-5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+		{1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+	('position-6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+		{1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+	('illegal-ep-1', '3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1',
+		{1: 18, 2: 92, 3: 1670, 4: 10138, 6: 1134888}),
+	('illegal-ep-2', '8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1',
+		{1: 13, 2: 102, 3: 1266, 4: 10276, 6: 1015133}),
+	('ep-capture-checks', '8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1',
+		{1: 15, 2: 126, 3: 1928, 4: 13931, 6: 1440467}),
+	('short-castling-check', '5k2/8/8/8/8/8/8/4K2R w K - 0 1',
+		{1: 15, 2: 66, 3: 1198, 4: 6399, 6: 661072}),
+	('long-castling-check', '3k4/8/8/8/8/8/8/R3K3 w Q - 0 1',
+		{1: 16, 2: 71, 3: 1286, 4: 7418, 6: 803711}),
+	('castling-rights', 'r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1',
+		{1: 26, 2: 1141, 3: 27826, 4: 1274206}),
+	('castling-prevented', 'r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1',
+		{1: 44, 2: 1494, 3: 50509, 4: 1720476}),
+	('promote-out-of-check', '2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1',
+		{1: 11, 2: 133, 3: 1442, 4: 19174, 6: 3821001}),
+	('discovered-check', '8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1',
+		{1: 29, 2: 165, 3: 5160, 4: 31961, 5: 1004658}),
+	('promote-to-check', '4k3/1P6/8/8/8/8/K7/8 w - - 0 1',
+		{1: 9, 2: 40, 3: 472, 4: 2661, 6: 217342}),
+	('underpromote-to-check', '8/P1k5/K7/8/8/8/8/8 w - - 0 1',
+		{1: 6, 2: 27, 3: 273, 4: 1329, 6: 92683}),
+	('self-stalemate', 'K1k5/8/P7/8/8/8/8/8 w - - 0 1',
+		{1: 2, 2: 6, 3: 13, 4: 63, 6: 2217}),
+	('stalemate-checkmate', '8/k1P5/8/1K6/8/8/8/8 w - - 0 1',
+		{1: 10, 2: 25, 3: 268, 4: 926, 7: 567584}),
+	('double-check', '8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1',
+		{1: 37, 2: 183, 3: 6559, 4: 23527})
+]
+
+def _position(fen):
+	return Bitboard.from_fen(fen)
+
+# Counts the leaf nodes of the legal move tree to the given depth, reusing
+# one move buffer per remaining depth. The generator only produces legal
+# moves, so the last ply is just a count.
+def perft(position, depth, buffers=None):
+	if depth == 0:
+		return 1
+
+	if buffers is None:
+		buffers = [move_buffer() for remaining in range(depth + 1)]
+
+	buffer = buffers[depth]
+	count = position.generate(buffer)
+	if depth == 1:
+		return count
+
+	nodes = 0
+	for index in range(count):
+		position.make_move(buffer[index])
+		nodes += perft(position, depth - 1, buffers)
+		position.unmake_move()
+
+	return nodes
+
+# Leaf node counts split by root move, for bisecting a wrong total
+def divide(position, depth):
+	counts = []
+	for move in position.moves():
+		position.make_move(move)
+		counts.append((position.as_algebraic_coords(move), perft(position, depth - 1)))
+		position.unmake_move()
+
+	return sorted(counts)
+
+def _report(name, depth, nodes, expected, elapsed):
+	if expected is None:
+		status = ''
+	else:
+		status = 'ok' if nodes == expected else 'FAIL (expected %d)' % expected
+	nps = nodes / elapsed if elapsed else 0
+	print('%-24s depth %d  %10d nodes  %8.2fs  %9.0f nps  %s' % (name, depth, nodes, elapsed, nps, status))
+
+# Runs every bundled position at the deepest known depth not above max_depth
+def run_suite(max_depth, names=None):
+	passed = True
+	total_nodes = 0
+	total_time = 0.0
+
+	for name, fen, counts in PERFT_POSITIONS:
+		if names and name not in names:
+			continue
+
+		depths = [depth for depth in counts if depth <= max_depth]
+		if not depths:
+			continue
+
+		depth = max(depths)
+		position = _position(fen)
+		start = time.perf_counter()
+		nodes = perft(position, depth)
+		elapsed = time.perf_counter() - start
+
+		_report(name, depth, nodes, counts[depth], elapsed)
+		passed = passed and nodes == counts[depth]
+		total_nodes += nodes
+		total_time += elapsed
+
+	if total_time:
+		print('total (%s): %d nodes in %.2fs, %.0f nps' % (BACKEND, total_nodes, total_time, total_nodes / total_time))
+
+	return passed
+
+# Runs the suite once per installed bit operation backend. The backend is
+# fixed when bitops is imported, so each run gets its own interpreter.
+def compare_backends(max_depth, names=None):
+	passed = True
+	for backend in BACKENDS:
+		if backend != 'int' and importlib.util.find_spec(backend) is None:
+			print('%s: not installed' % backend)
+			continue
+
+		print('%s:' % backend)
+		sys.stdout.flush()
+		command = [sys.executable, os.path.abspath(__file__), '-d', str(max_depth)]
+		for name in names or []:
+			command += ['-p', name]
+		result = subprocess.run(command, env=dict(os.environ, DERPFISH_BITOPS=backend))
+		passed = passed and result.returncode == 0
+
+	return passed
+
+# Seconds from launching the engine until it has answered protover with
+# its features, which is when an interface can start a game
+def _startup_time():
+	engine = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'derpfish.py')
+	start = time.perf_counter()
+	process = subprocess.Popen([sys.executable, engine, '--log-file', os.devnull],
+		stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+	process.stdin.write('xboard\nprotover 2\n')
+	process.stdin.flush()
+	for line in process.stdout:
+		if 'done=1' in line:
+			break
+	elapsed = time.perf_counter() - start
+	process.stdin.write('quit\n')
+	process.stdin.close()
+	process.wait()
+	return elapsed
+
+# Cold start with the table cache removed, so the tables are built, and
+# warm with the cache written by the run before
+def startup(runs):
+	from tables import cache_path
+	cache = cache_path('attacks')
+	cold, warm = [], []
+	for run in range(runs):
+		if os.path.exists(cache):
+			os.remove(cache)
+		cold.append(_startup_time())
+		warm.append(_startup_time())
+
+	for name, times in (('cold', cold), ('cached', warm)):
+		print('startup %-6s best %.3fs  mean %.3fs  (%d runs)' % (name, min(times), sum(times) / len(times), runs))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Perft move generation checks and benchmark')
+	parser.add_argument('-d', '--depth', type=int, default=3)
+	parser.add_argument('-p', '--position', action='append', help='bundled position name, may be repeated')
+	parser.add_argument('--fen', help='count a custom position instead of the bundled suite')
+	parser.add_argument('--divide', action='store_true', help='split the count by root move')
+	parser.add_argument('--compare-backends', action='store_true', help='run the suite under every installed bit operation backend')
+	parser.add_argument('--startup', type=int, metavar='RUNS', help='time engine startup with and without the table cache instead')
+	args = parser.parse_args()
+
+	if args.fen or args.divide:
+		name = args.position[0] if args.position else 'start'
+		fen = args.fen or dict((name, fen) for name, fen, counts in PERFT_POSITIONS)[name]
+		position = _position(fen)
+		start = time.perf_counter()
+		if args.divide:
+			counts = divide(position, args.depth)
+			for notation, nodes in counts:
+				print('%s: %d' % (notation, nodes))
+			nodes = sum(nodes for notation, nodes in counts)
+		else:
+			nodes = perft(position, args.depth)
+		_report(args.fen or name, args.depth, nodes, None, time.perf_counter() - start)
+	elif args.startup:
+		startup(args.startup)
+	elif args.compare_backends:
+		sys.exit(0 if compare_backends(args.depth, args.position) else 1)
+	else:
+		sys.exit(0 if run_suite(args.depth, args.position) else 1)
@@ -0,0 +1,403 @@
+from collections import namedtuple
+from copy import copy
+from bitboard import PIECE_VALUES
+from move import MOVE_MASK, move_buffer, move_capture
+from movepick import MoveOrdering, ordered_captures, staged_moves, mvv_lva
+from pawns import PawnTable
+from tt import TT_EXACT, TT_LOWER, TT_UPPER
+import logging, time
+
+logger = logging.getLogger('search')
+
+INFINITY = 31000
+MATE = 30000
+MAX_PLY = 100
+
+ASPIRATION_DEPTH = 4
+ASPIRATION_WINDOW = 50
+
+# Quiescence skips a capture that can't bring the score up to alpha even
+# with this much positional gain on top of the captured piece
+DELTA_MARGIN = 200
+
+class SearchAborted(Exception):
+	pass
+
+# A completed iterative deepening iteration. nodes is the running total at
+# the end of it, time is in seconds since the search started.
+Iteration = namedtuple('Iteration', ['depth', 'score', 'nodes', 'time', 'pv'])
+
+# Mate scores are stored relative to the node so they stay valid at any ply
+def _score_to_tt(score, ply):
+	if score > MATE - MAX_PLY:
+		return score + ply
+	elif score < -MATE + MAX_PLY:
+		return score - ply
+	return score
+
+def _score_from_tt(score, ply):
+	if score > MATE - MAX_PLY:
+		return score - ply
+	elif score < -MATE + MAX_PLY:
+		return score + ply
+	return score
+
+# stop is anything with is_set(), like a threading or multiprocessing Event,
+# and aborts the search the next time the clock is checked. helper numbers
+# the extra searches of a parallel search from 1, the main search is 0.
+# node_limit ends the search after about that many nodes, whatever the time.
+# post, if given, is called with each completed Iteration. pawns is the
+# pawn hash table to keep between searches, a fresh one is used without.
+class Search:
+	def __init__(self, position, tt, soft_limit=None, hard_limit=None, max_depth=None, stop=None, helper=0, node_limit=None, post=None, pawns=None):
+		# Search a private copy so the game position is never left mid-line
+		self.position = copy(position)
+		self.tt = tt
+		self.pawns = pawns if pawns is not None else PawnTable()
+		self.soft_limit = soft_limit
+		self.hard_limit = hard_limit
+		self.max_depth = min(max_depth or MAX_PLY, MAX_PLY)
+		self.stop = stop
+		self.helper = helper
+		self.node_limit = node_limit
+		self.post = post
+		self.nodes = 0
+		# Counters for record(). Cutoffs count fail highs in the tree below
+		# the root, and how many of them came from the first move searched.
+		self.stats = {
+			'qnodes': 0,
+			'tt_probes': 0,
+			'tt_hits': 0,
+			'tt_cutoffs': 0,
+			'cutoffs': 0,
+			'first_move_cutoffs': 0,
+			'delta_pruned': 0,
+			'see_pruned': 0,
+			'pawn_probes': 0,
+			'pawn_hits': 0,
+			'helper_nodes': 0
+		}
+		self.iterations = []
+		self.time = 0.0
+		self.best_move = None
+		self.best_score = -INFINITY
+		# One move list per ply, reused by every node at that ply
+		self.buffers = [move_buffer() for ply in range(MAX_PLY + 1)]
+		self.ordering = MoveOrdering(MAX_PLY + 1)
+
+	def _elapsed(self):
+		return time.monotonic() - self.start
+
+	# The opponent played the move we were pondering on: from now on this is
+	# a normal search against the clock, timed from here
+	def ponder_hit(self, soft_limit, hard_limit):
+		self.start = time.monotonic()
+		self.soft_limit = soft_limit
+		self.hard_limit = hard_limit
+
+	def _check_time(self):
+		if self.hard_limit is not None and self._elapsed() >= self.hard_limit:
+			raise SearchAborted()
+		if self.stop is not None and self.stop.is_set():
+			raise SearchAborted()
+		if self.node_limit is not None and self.nodes >= self.node_limit:
+			raise SearchAborted()
+
+
+	# Iterative deepening: each completed depth leaves a usable best move
+	# behind, so running out of time never leaves us without one
+	def run(self):
+		self.start = time.monotonic()
+		pawn_probes = self.pawns.probes
+		pawn_hits = self.pawns.hits
+		# Helpers share the main search's table and age
+		if not self.helper:
+			self.tt.new_search()
+
+		root_moves = self.position.moves()
+		if not root_moves:
+			self.time = self._elapsed()
+			return None
+
+		# Good captures first until the iterations have an opinion
+		root_moves.sort(key=mvv_lva, reverse=True)
+
+		self.best_move = root_moves[0]
+		root_ply = len(self.position.history)
+		score = 0
+		# Odd helpers run a ply ahead so the threads don't all finish the same depths together
+		for depth in range(1 + (self.helper & 1), self.max_depth + 1):
+			try:
+				score = self._aspiration(depth, score, root_moves)
+			except SearchAborted:
+				logger.debug('search aborted at depth %d' % depth)
+				# The abort can come from anywhere in the tree, take the line back
+				while len(self.position.history) > root_ply:
+					self.position.unmake_move()
+				break
+
+			iteration = Iteration(depth, score, self.nodes, self._elapsed(), self.principal_variation())
+			self.iterations.append(iteration)
+			if self.post:
+				self.post(iteration)
+			logger.debug('depth %d score %d nodes %d time %.2f best %s' % (
+				depth, score, self.nodes, iteration.time, self.position.as_algebraic_coords(self.best_move)
+			))
+
+			# Put the best move first for the next iteration
+			root_moves.remove(self.best_move)
+			root_moves.insert(0, self.best_move)
+
+			if abs(score) > MATE - MAX_PLY or len(root_moves) == 1:
+				break
+
+			# A new iteration costs several times the last one, don't start what we can't finish
+			if self.soft_limit is not None and self._elapsed() >= self.soft_limit * 0.5:
+				break
+
+		self.stats['pawn_probes'] = self.pawns.probes - pawn_probes
+		self.stats['pawn_hits'] = self.pawns.hits - pawn_hits
+		self.time = self._elapsed()
+		return self.best_move
+
+	# What the last run did, as a dict that serializes straight to JSON.
+	# The branching factor is the node count of the last iteration over the
+	# one before it.
+	def record(self):
+		stats = self.stats
+		iteration_nodes = [iteration.nodes for iteration in self.iterations]
+		iteration_nodes = [nodes - previous for nodes, previous in zip(iteration_nodes, [0] + iteration_nodes)]
+		last = self.iterations[-1] if self.iterations else None
+
+		return {
+			'move': self.position.as_algebraic_coords(self.best_move) if self.best_move else None,
+			'depth': last.depth if last else 0,
+			'score': last.score if last else None,
+			'nodes': self.nodes,
+			'qnodes': stats['qnodes'],
+			'helper_nodes': stats['helper_nodes'],
+			'time': round(self.time, 3),
+			'nps': int(self.nodes / self.time) if self.time else 0,
+			'tt_probes': stats['tt_probes'],
+			'tt_hits': stats['tt_hits'],
+			'tt_cutoffs': stats['tt_cutoffs'],
+			'delta_pruned': stats['delta_pruned'],
+			'see_pruned': stats['see_pruned'],
+			'pawn_probes': stats['pawn_probes'],
+			'pawn_hit_rate': round(stats['pawn_hits'] / stats['pawn_probes'], 3) if stats['pawn_probes'] else None,
+			'first_move_cutoff_rate': round(stats['first_move_cutoffs'] / stats['cutoffs'], 3) if stats['cutoffs'] else None,
+			'branching_factor': round(iteration_nodes[-1] / iteration_nodes[-2], 2) if len(iteration_nodes) > 1 and iteration_nodes[-2] else None,
+			'iterations': [
+				{'depth': iteration.depth, 'score': iteration.score, 'nodes': nodes, 'time': round(iteration.time, 3)}
+				for iteration, nodes in zip(self.iterations, iteration_nodes)
+			]
+		}
+
+	# The best line as far as the transposition table still remembers it
+	def principal_variation(self, limit=MAX_PLY):
+		position = self.position
+		pv = []
+		move = self.best_move
+		while move and len(pv) < limit:
+			if not position.is_legal(move):
+				break
+
+			position.make_move(move)
+			pv.append(move)
+			if position.is_repetition():
+				break
+
+			move = self.tt.probe(position.hash()) & MOVE_MASK
+
+		for move in pv:
+			position.unmake_move()
+
+		return pv
+
+	def _aspiration(self, depth, score, root_moves):
+		if depth < ASPIRATION_DEPTH:
+			return self._search_root(depth, -INFINITY, INFINITY, root_moves)
+
+		window = ASPIRATION_WINDOW
+		alpha = max(score - window, -INFINITY)
+		beta = min(score + window, INFINITY)
+		while True:
+			score = self._search_root(depth, alpha, beta, root_moves)
+			if score <= alpha:
+				alpha = max(score - window, -INFINITY)
+			elif score >= beta:
+				beta = min(score + window, INFINITY)
+			else:
+				return score
+
+			window *= 2
+
+	def _search_root(self, depth, alpha, beta, root_moves):
+		position = self.position
+		alpha_orig = alpha
+		best_score = -INFINITY
+		best_move = None
+
+		for index, move in enumerate(root_moves):
+			position.make_move(move)
+			if index == 0:
+				score = -self._negamax(depth - 1, -beta, -alpha, 1)
+			else:
+				score = -self._negamax(depth - 1, -alpha - 1, -alpha, 1)
+				if alpha < score < beta:
+					score = -self._negamax(depth - 1, -beta, -alpha, 1)
+			position.unmake_move()
+
+			if score > best_score:
+				best_score = score
+				best_move = move
+				if score > alpha:
+					alpha = score
+					# Adopt a new best move as soon as it is proven, even mid-iteration
+					self.best_move = move
+					self.best_score = score
+					if alpha >= beta:
+						break
+
+		self._store(position.hash(), depth, alpha_orig, beta, best_score, best_move, 0)
+		return best_score
+
+	def _store(self, key, depth, alpha, beta, score, move, ply):
+		if score >= beta:
+			bound = TT_LOWER
+		elif score > alpha:
+			bound = TT_EXACT
+		else:
+			# No move proved best at a fail-low node
+			bound = TT_UPPER
+			move = None
+
+		self.tt.store(key, depth, bound, _score_to_tt(score, ply), move & MOVE_MASK if move else 0)
+
+	# The clock is read at every node. Reading it costs a few percent of a
+	# node at most, and the hard limit is then overrun by one node's work,
+	# under a millisecond, instead of however long a batch of nodes takes
+	# at whatever speed the search happens to run. timecontrol's
+	# SAFETY_MARGIN only has to cover I/O and scheduling.
+	def _count_node(self):
+		self.nodes += 1
+		self._check_time()
+
+	# Negamax alpha-beta with principal variation search
+	def _negamax(self, depth, alpha, beta, ply):
+		position = self.position
+		in_check = position.in_check()
+		if in_check:
+			depth += 1
+
+		if depth <= 0:
+			return self._quiesce(alpha, beta, ply)
+
+		self._count_node()
+		if position.is_repetition():
+			return 0
+
+		if ply >= MAX_PLY:
+			return position.evaluate(self.pawns)
+
+		key = position.hash()
+		alpha_orig = alpha
+		tt_move = 0
+		stats = self.stats
+		stats['tt_probes'] += 1
+		# The packed word, unpacked here as in tt.decode()
+		data = self.tt.probe(key)
+		if data:
+			stats['tt_hits'] += 1
+			tt_move = data & 0xFFFFFF
+			if (data >> 40) & 0xFF >= depth and beta - alpha == 1:
+				score = _score_from_tt(((data >> 24) & 0xFFFF) - 32768, ply)
+				bound = (data >> 48) & 0x3
+				if (bound == TT_EXACT or
+					bound == TT_LOWER and score >= beta or
+					bound == TT_UPPER and score <= alpha):
+					stats['tt_cutoffs'] += 1
+					return score
+
+		best_score = -INFINITY
+		best_move = None
+		legal = 0
+		for move in staged_moves(position, self.buffers[ply], tt_move, self.ordering, ply):
+			position.make_move(move)
+			legal += 1
+			if legal == 1:
+				score = -self._negamax(depth - 1, -beta, -alpha, ply + 1)
+			else:
+				score = -self._negamax(depth - 1, -alpha - 1, -alpha, ply + 1)
+				if alpha < score < beta:
+					score = -self._negamax(depth - 1, -beta, -alpha, ply + 1)
+			position.unmake_move()
+
+			if score > best_score:
+				best_score = score
+				best_move = move
+				if score > alpha:
+					alpha = score
+					if alpha >= beta:
+						stats['cutoffs'] += 1
+						if legal == 1:
+							stats['first_move_cutoffs'] += 1
+						self.ordering.cutoff(position, move, ply, depth)
+						break
+
+		if not legal:
+			return -MATE + ply if in_check else 0
+
+		self._store(key, depth, alpha_orig, beta, best_score, best_move, ply)
+		return best_score
+
+	# Searches captures and promotions only, until the position is quiet, so
+	# the score of a leaf never stops halfway through an exchange. The side
+	# on move may stand pat on the static score instead. Captures that lose
+	# material by static exchange evaluation, or that can't reach alpha
+	# even with a margin, are not searched. In check there is no standing
+	# pat and every evasion is searched.
+	def _quiesce(self, alpha, beta, ply):
+		self._count_node()
+		stats = self.stats
+		stats['qnodes'] += 1
+		position = self.position
+		if ply >= MAX_PLY:
+			return position.evaluate(self.pawns)
+
+		in_check = position.in_check()
+		if in_check:
+			best_score = -INFINITY
+			moves = staged_moves(position, self.buffers[ply], 0, self.ordering, ply)
+		else:
+			best_score = position.evaluate(self.pawns)
+			if best_score >= beta:
+				return best_score
+			alpha = max(alpha, best_score)
+			moves = ordered_captures(position, self.buffers[ply])
+
+		for move in moves:
+			if not in_check:
+				capture = move_capture(move)
+				if capture and not (move >> 18) & 7 and best_score + PIECE_VALUES[capture] + DELTA_MARGIN <= alpha:
+					stats['delta_pruned'] += 1
+					continue
+				if position.see(move) < 0:
+					stats['see_pruned'] += 1
+					continue
+
+			position.make_move(move)
+			score = -self._quiesce(-beta, -alpha, ply + 1)
+			position.unmake_move()
+
+			if score > best_score:
+				best_score = score
+				if score > alpha:
+					alpha = score
+					if alpha >= beta:
+						break
+
+		if best_score == -INFINITY:
+			return -MATE + ply
+
+		return best_score
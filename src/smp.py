@@ -0,0 +1,90 @@
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+from pawns import PawnTable
+from search import Search
+from tt import TranspositionTable, AGE_CYCLE
+import logging, multiprocessing
+
+logger = logging.getLogger('smp')
+
+# Per worker process state, set up once by _init_worker
+_worker = {}
+
+def _init_worker(tt_name, size_mb, stop):
+	_worker['tt'] = TranspositionTable.attach(tt_name, size_mb)
+	_worker['stop'] = stop
+	_worker['pawns'] = PawnTable()
+
+def _ready():
+	return True
+
+# Helpers have no clock of their own, they run until the main search stops them
+def _helper_search(position, max_depth, age, helper):
+	tt = _worker['tt']
+	tt.age = age
+	search = Search(position, tt, None, None, max_depth, _worker['stop'], helper, pawns=_worker['pawns'])
+	search.run()
+	return search.nodes
+
+# Lazy SMP: helper processes search the same root as the main search and
+# only talk to it through the shared transposition table, which they keep
+# filling with results the main search then gets for free. The GIL rules
+# out threads, so each helper is a worker process with the table mapped
+# from shared memory.
+class LazySMP:
+	def __init__(self, tt, cores):
+		self.tt = tt
+		self.cores = cores
+		self.stop = multiprocessing.Event()
+		self.pool = ProcessPoolExecutor(
+			max_workers=cores - 1,
+			initializer=_init_worker,
+			initargs=(tt.name, tt.size_mb, self.stop)
+		)
+		# The last run's helper tasks, until finish() collects them
+		self.helpers = []
+
+		# The pool forks every worker on its first task. Do that now, from the
+		# calling thread, not from a search thread while another thread may
+		# hold the logging lock.
+		for ready in [self.pool.submit(_ready) for helper in range(1, cores)]:
+			ready.result()
+
+	# Runs the main search here while the helpers run in the pool, and
+	# returns the main search's move. The helpers are told to stop as soon
+	# as it is done but not waited for, so the move can go out first: call
+	# finish() after playing it.
+	def run(self, main):
+		# A new run must not start while the last one's helpers still search
+		self._wait()
+		self.stop.clear()
+
+		# Tasks are pickled on a pool thread, so hand over a copy the main search won't touch
+		root = copy(main.position)
+		# Helpers write with the age the main search is about to move the table to
+		age = (self.tt.age + 1) % AGE_CYCLE
+		self.helpers = [
+			self.pool.submit(_helper_search, root, main.max_depth, age, helper)
+			for helper in range(1, self.cores)
+		]
+
+		try:
+			return main.run()
+		finally:
+			self.stop.set()
+
+	# Total nodes of the last run's helpers, once they have all stopped
+	def _wait(self):
+		nodes = sum(helper.result() for helper in self.helpers)
+		self.helpers = []
+		return nodes
+
+	# Waits for the helpers of the last run, main, and adds their node
+	# counts to its stats
+	def finish(self, main):
+		main.stats['helper_nodes'] = self._wait()
+		logger.debug('smp: %d cores, %d nodes, main search %d' % (self.cores, main.nodes + main.stats['helper_nodes'], main.nodes))
+
+	def close(self):
+		self.stop.set()
+		self.pool.shutdown()
@@ -0,0 +1,91 @@
+from array import array
+import hashlib, logging, mmap, os, struct, sys, zlib
+
+logger = logging.getLogger('tables')
+
+# Tables that are slow to build are kept in binary cache files next to the
+# bytecode, so starting the engine maps a file instead of rebuilding them.
+# A cache file starts with a header:
+#   8 bytes   magic
+#   4 bytes   format version
+#   16 bytes  fingerprint of the module that builds the tables
+#   4 bytes   CRC-32 of everything after the header
+# then holds one record per table: its name, zero padded to 16 bytes, the
+# number of 64-bit entries and the entries in native byte order. A file
+# with the wrong header or checksum is stale and gets rebuilt.
+
+MAGIC = b'DERPTABL'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sI16sI')
+RECORD = struct.Struct('<16sQ')
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__pycache__')
+
+def cache_path(name):
+	return os.path.join(CACHE_DIR, '%s.tables' % name)
+
+# Any edit to the building module, or another byte order, makes the cache stale
+def _fingerprint(source_path):
+	digest = hashlib.blake2b(sys.byteorder.encode(), digest_size=16)
+	with open(source_path, 'rb') as source:
+		digest.update(source.read())
+
+	return digest.digest()
+
+def _load(path, fingerprint):
+	tables = {}
+	with open(path, 'rb') as cache_file, mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+		magic, version, stored, checksum = HEADER.unpack_from(mapped)
+		if magic != MAGIC or version != FORMAT_VERSION or stored != fingerprint:
+			return None
+
+		with memoryview(mapped) as view:
+			if zlib.crc32(view[HEADER.size:]) != checksum:
+				return None
+
+			offset = HEADER.size
+			while offset < len(view):
+				name, count = RECORD.unpack_from(view, offset)
+				offset += RECORD.size
+				table = array('Q')
+				table.frombytes(view[offset:offset + 8 * count])
+				tables[name.rstrip(b'\0').decode()] = table
+				offset += 8 * count
+
+	return tables
+
+# Written to a temporary file first, so a process reading the cache never
+# sees half of one
+def _save(path, fingerprint, tables):
+	payload = b''.join(RECORD.pack(name.encode(), len(table)) + table.tobytes() for name, table in tables.items())
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	temporary = '%s.%d' % (path, os.getpid())
+	with open(temporary, 'wb') as cache_file:
+		cache_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, fingerprint, zlib.crc32(payload)))
+		cache_file.write(payload)
+	os.replace(temporary, path)
+
+# The tables build() makes, a dict of name to 64-bit ints, as array('Q')s.
+# They come from the named cache file when it is current. Otherwise they
+# are built and the cache written for next time, if the directory lets us.
+# source_path is the module that builds them.
+def cached_tables(name, source_path, build):
+	path = cache_path(name)
+	fingerprint = _fingerprint(source_path)
+	try:
+		tables = _load(path, fingerprint)
+		if tables is not None:
+			return tables
+		logger.info('%s tables are stale, rebuilding' % name)
+	except FileNotFoundError:
+		logger.info('no cached %s tables, building' % name)
+	except (OSError, ValueError, struct.error) as error:
+		logger.warning('unreadable %s table cache %s: %s' % (name, path, error))
+
+	tables = dict((table_name, array('Q', table)) for table_name, table in build().items())
+	try:
+		_save(path, fingerprint, tables)
+	except OSError as error:
+		logger.warning('could not cache %s tables: %s' % (name, error))
+
+	return tables
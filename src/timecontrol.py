@@ -0,0 +1,79 @@
+import logging
+
+logger = logging.getLogger('timecontrol')
+
+# Seconds held back on every move for I/O and process scheduling. The
+# search reads the clock at every node, so it stops within a millisecond
+# of its hard limit.
+SAFETY_MARGIN = 0.05
+
+# Moves we assume are left in sudden-death and increment games
+DEFAULT_MOVES_TO_GO = 30
+
+# Tracks the XBoard clock settings and turns them into per-move budgets
+class TimeControl:
+	def __init__(self):
+		self.moves_per_session = 0
+		self.base = 300.0
+		self.increment = 0.0
+		self.fixed_time = None
+		self.max_depth = None
+		self.remaining = None
+		self.opponent_remaining = None
+
+	# level MPS BASE INC, where BASE is minutes or minutes:seconds
+	def level(self, moves_per_session, base, increment):
+		if ':' in base:
+			minutes, seconds = base.split(':')
+			self.base = int(minutes) * 60 + float(seconds)
+		else:
+			self.base = float(base) * 60
+
+		self.moves_per_session = int(moves_per_session)
+		self.increment = float(increment)
+		self.fixed_time = None
+		self.remaining = None
+
+	# st TIME, an exact number of seconds per move
+	def set_fixed_time(self, seconds):
+		self.fixed_time = float(seconds)
+
+	# sd DEPTH
+	def set_max_depth(self, depth):
+		self.max_depth = int(depth)
+
+	# time and otim report centiseconds
+	def set_remaining(self, centiseconds):
+		self.remaining = int(centiseconds) / 100.0
+
+	def set_opponent_remaining(self, centiseconds):
+		self.opponent_remaining = int(centiseconds) / 100.0
+
+	# Returns (soft, hard) limits in seconds for the next move. The search
+	# stops starting new iterations after the soft limit and aborts at the
+	# hard one, which never runs past the clock.
+	def allocate(self, moves_made):
+		if self.fixed_time is not None:
+			budget = max(0.01, self.fixed_time - SAFETY_MARGIN)
+			return budget, budget
+
+		remaining = self.remaining if self.remaining is not None else self.base
+		usable = max(0.01, remaining - SAFETY_MARGIN)
+
+		if self.moves_per_session:
+			moves_to_go = self.moves_per_session - moves_made % self.moves_per_session
+		else:
+			moves_to_go = DEFAULT_MOVES_TO_GO
+
+		soft = usable / moves_to_go + self.increment * 0.75
+
+		# Spend a little more when we are ahead on the clock, a little less when behind
+		if self.opponent_remaining:
+			ratio = remaining / self.opponent_remaining
+			soft *= min(1.25, max(0.75, ratio))
+
+		hard = min(usable if moves_to_go == 1 else usable / 2, soft * 4)
+		soft = min(soft, hard)
+
+		logger.debug('time: remaining %.2f, moves to go %d, soft %.2f, hard %.2f' % (remaining, moves_to_go, soft, hard))
+		return soft, hard
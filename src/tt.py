@@ -0,0 +1,150 @@
+from collections import namedtuple
+
+# An unpacked data word, for debugging and stats. The search reads the
+# packed word probe() returns instead, building one of these per node
+# would cost an allocation on every probe.
+TTEntry = namedtuple('TTEntry', ['depth', 'bound', 'score', 'move'])
+
+TT_EXACT = 1
+TT_LOWER = 2
+TT_UPPER = 3
+
+DEFAULT_SIZE_MB = 16
+
+# Each entry is two 64-bit words, the full key xor the data word, and the
+# packed data word:
+#   bits  0-23  best move without its ordering score, 0 for none
+#   bits 24-39  score + 32768
+#   bits 40-47  depth
+#   bits 48-49  bound
+#   bits 50-55  search age
+ENTRY_WORDS = 2
+ENTRY_BYTES = 8 * ENTRY_WORDS
+BUCKET_SIZE = 4
+AGE_CYCLE = 64
+
+# The TTEntry for a data word probe() returned
+def decode(data):
+	return TTEntry(
+		depth=(data >> 40) & 0xFF,
+		bound=(data >> 48) & 0x3,
+		score=((data >> 24) & 0xFFFF) - 32768,
+		move=data & 0xFFFFFF
+	)
+
+# With shared=True the table lives in a shared memory block that worker
+# processes map with attach(). Several processes write it without locks:
+# the key word is stored xor the data word, so an entry torn by two
+# concurrent writers no longer matches its key and is simply a miss.
+class TranspositionTable:
+	def __init__(self, size_mb=DEFAULT_SIZE_MB, shared=False):
+		self.shared = shared
+		self.memory = None
+		self.resize(size_mb)
+
+	# Maps a table another process created with shared=True
+	@staticmethod
+	def attach(name, size_mb):
+		tt = TranspositionTable.__new__(TranspositionTable)
+		from multiprocessing import shared_memory
+		tt.shared = True
+		tt.memory = shared_memory.SharedMemory(name=name)
+		tt._map(size_mb, tt.memory.buf)
+		return tt
+
+	def _map(self, size_mb, buffer):
+		self.size_mb = size_mb
+		self.buckets = len(buffer) // (ENTRY_BYTES * BUCKET_SIZE)
+		self.buffer = buffer
+		self.table = memoryview(buffer).cast('Q')
+		self.age = 0
+
+	@property
+	def name(self):
+		return self.memory.name if self.memory else None
+
+	def resize(self, size_mb):
+		self.close(unlink=True)
+		buckets = max(1, (size_mb * 1024 * 1024) // (ENTRY_BYTES * BUCKET_SIZE))
+		size = buckets * BUCKET_SIZE * ENTRY_BYTES
+		if self.shared:
+			# Only imported for shared tables, it is slow to load
+			from multiprocessing import shared_memory
+			self.memory = shared_memory.SharedMemory(create=True, size=size)
+			buffer = self.memory.buf
+			# Fresh blocks are zeroed on Linux but not everywhere
+			buffer[:] = bytes(size)
+		else:
+			buffer = bytearray(size)
+		self._map(size_mb, buffer)
+
+	def clear(self):
+		self.buffer[:] = bytes(len(self.buffer))
+		self.age = 0
+
+	# Releases the shared memory block, unlink frees it for every process
+	def close(self, unlink=False):
+		if self.memory is not None:
+			self.table.release()
+			self.memory.close()
+			if unlink:
+				self.memory.unlink()
+			self.memory = None
+
+	# Called once per search so entries from older searches get replaced first
+	def new_search(self):
+		self.age = (self.age + 1) % AGE_CYCLE
+
+	def _bucket(self, key):
+		return (key % self.buckets) * BUCKET_SIZE * ENTRY_WORDS
+
+	# The packed data word stored for key, 0 for a miss. Stored words are
+	# never 0, the bound bits are always set.
+	def probe(self, key):
+		table = self.table
+		index = self._bucket(key)
+		for index in range(index, index + BUCKET_SIZE * ENTRY_WORDS, ENTRY_WORDS):
+			data = table[index + 1]
+			if data and table[index] ^ data == key:
+				return data
+
+		return 0
+
+	def store(self, key, depth, bound, score, move=0):
+		table = self.table
+		bucket = self._bucket(key)
+		replace = None
+		replace_worth = None
+
+		for index in range(bucket, bucket + BUCKET_SIZE * ENTRY_WORDS, ENTRY_WORDS):
+			data = table[index + 1]
+			if not data:
+				replace = index
+				break
+
+			if table[index] ^ data == key:
+				# Don't let a shallow bound overwrite a deeper result from this search
+				if bound != TT_EXACT and ((data >> 40) & 0xFF) > depth + 2 and (data >> 50) == self.age:
+					return
+
+				# Keep the old move if this search didn't find one
+				move = move or data & 0xFFFFFF
+				replace = index
+				break
+
+			# Prefer to evict shallow entries and entries from earlier searches
+			entry_age = (self.age - (data >> 50)) % AGE_CYCLE
+			worth = ((data >> 40) & 0xFF) - 8 * entry_age
+			if replace is None or worth < replace_worth:
+				replace = index
+				replace_worth = worth
+
+		data = (
+			(move & 0xFFFFFF) |
+			((score + 32768) & 0xFFFF) << 24 |
+			(depth & 0xFF) << 40 |
+			bound << 48 |
+			self.age << 50
+		)
+		table[replace] = key ^ data
+		table[replace + 1] = data